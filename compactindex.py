@@ -0,0 +1,209 @@
+# A compact alternative to PatternMatcher's flat substring_to_alt_domain_count_dict.
+#
+# The flat dict of the form {'substring': {'representation': count, ...}} costs one str object per
+# substring, one inner dict per substring, and one str and one int object per representation.
+# That is millions of small objects to allocate, and to unpickle at startup.
+#
+# CompactIndex instead interns substrings and representations to integer IDs (see StringTable),
+# and keeps counts in typed arrays, CSR-style:
+#
+#	substring id:    0 ('sa')          1 ('sau')
+#	offsets:         0                 3                 5
+#	rep_ids:        [ 4,    9,    2,   11,   7 ]
+#	counts:         [ 667,  122,  15,  65,   9 ]
+#
+# Substring s owns columns offsets[s]:offsets[s + 1]. Decrementing a count to zero leaves its column
+# in place (a zero count is treated as absent), so removing a word and adding it back during
+# cross-validation never moves anything. Pairs that were never part of the packed columns go into
+# a small overflow dict until the next compact().
+#
+# CompactIndex behaves like a dict (get, [], in, del, len, iteration, ==), so PatternMatcher's add,
+# remove and simulate_leaveoneout work on it as before. Inner dicts are built on request and are
+# NOT live: after changing one, store it again with index[substring] = entry.
+from array import array
+from collections.abc import MutableMapping
+import zlib
+
+# Interns strings to consecutive integer IDs.
+# Strings live back to back in a single str (plus a list of strings interned since the last freeze),
+# and an open-addressing hash table of IDs (an array, keyed by crc32 so it survives pickling) finds them again.
+class StringTable:
+	def __init__(self, strings=()):
+		self.blob = ''
+		self.offsets = array('i', [0]) # String i is blob[offsets[i]:offsets[i + 1]] ...
+		self.extra = [] # ... unless it was interned since the last freeze.
+		self.size = 0
+		capacity = 16
+		while capacity < 2*len(strings):
+			capacity *= 2
+		self.table = array('i', [-1])*capacity
+		for s in strings:
+			self.intern(s)
+		self.freeze()
+
+	def __len__(self):
+		return self.size
+
+	# ID -> string.
+	def __getitem__(self, i):
+		frozen = len(self.offsets) - 1
+		if i < frozen:
+			return self.blob[self.offsets[i]:self.offsets[i + 1]]
+		return self.extra[i - frozen]
+
+	# Where s is in the hash table, or where it would go.
+	def slot(self, s):
+		mask = len(self.table) - 1
+		h = zlib.crc32(s.encode()) & mask
+		while True:
+			i = self.table[h]
+			if i == -1 or self[i] == s:
+				return h
+			h = (h + 1) & mask
+
+	# String -> ID, or -1 if s was never interned.
+	def find(self, s):
+		return self.table[self.slot(s)]
+
+	# String -> ID, interning s first if needed.
+	def intern(self, s):
+		h = self.slot(s)
+		if self.table[h] != -1:
+			return self.table[h]
+		i = self.size
+		self.extra.append(s)
+		self.table[h] = i
+		self.size += 1
+		# Keep the table at most half full.
+		if 2*self.size > len(self.table):
+			self.table = array('i', [-1])*(2*len(self.table))
+			for j in range(self.size):
+				self.table[self.slot(self[j])] = j
+		return i
+
+	# Pack recently interned strings into the blob.
+	def freeze(self):
+		if len(self.extra) == 0:
+			return
+		self.blob += ''.join(self.extra)
+		for s in self.extra:
+			self.offsets.append(self.offsets[-1] + len(s))
+		self.extra = []
+
+	def __getstate__(self):
+		self.freeze()
+		return self.__dict__
+
+class CompactIndex(MutableMapping):
+	# Packs a flat dict of the form {'substring': {'representation': count, ...}}, preserving
+	# the order of each inner dict.
+	def __init__(self, d=None):
+		d = {} if d is None else d
+		self.substrings = StringTable(list(d))
+		representations = {}
+		for key in d:
+			for representation in d[key]:
+				representations[representation] = None
+		self.representations = StringTable(list(representations))
+		self.offsets = array('i', [0])
+		self.rep_ids = array('i')
+		self.counts = array('i')
+		for key in d:
+			for representation, count in d[key].items():
+				self.rep_ids.append(self.representations.find(representation))
+				self.counts.append(count)
+			self.offsets.append(len(self.counts))
+		# Substring ID -> {representation ID: count} for anything not in the packed columns.
+		self.overflow = {}
+		self.size = len(d)
+
+	# Repacks everything, folding in the overflow and dropping zero counts.
+	def compact(self):
+		packed = CompactIndex(dict(self.items()))
+		self.__dict__.update(packed.__dict__)
+
+	# The inner dict for substring ID s, which is empty if s is absent.
+	def entry(self, s):
+		entry = {}
+		if s < len(self.offsets) - 1:
+			for k in range(self.offsets[s], self.offsets[s + 1]):
+				if self.counts[k] != 0:
+					entry[self.representations[self.rep_ids[k]]] = self.counts[k]
+		extra = self.overflow.get(s, None)
+		if extra is not None:
+			for r in extra:
+				entry[self.representations[r]] = extra[r]
+		return entry
+
+	def is_present(self, s):
+		if s in self.overflow:
+			return True
+		if s < len(self.offsets) - 1:
+			for k in range(self.offsets[s], self.offsets[s + 1]):
+				if self.counts[k] != 0:
+					return True
+		return False
+
+	# Returns a dict of the form {(substring, index within input_word): inner dict}
+	# for every substring of input_word (of length 2 or more) present in the index.
+	def find_substrings(self, input_word):
+		found = {}
+		for i in range(len(input_word) - 1):
+			for j in range(i + 2, len(input_word) + 1):
+				key = input_word[i:j]
+				s = self.substrings.find(key)
+				entry = self.entry(s) if s != -1 else None
+				# Every longer substring starting at i is missing, too.
+				if not entry:
+					break
+				found[(key, i)] = entry
+		return found
+
+	def __getitem__(self, key):
+		entry = self.get(key, None)
+		if entry is None:
+			raise KeyError(key)
+		return entry
+
+	def get(self, key, default=None):
+		s = self.substrings.find(key)
+		if s == -1:
+			return default
+		entry = self.entry(s)
+		return entry if len(entry) != 0 else default
+
+	def __setitem__(self, key, value):
+		s = self.substrings.intern(key)
+		if not self.is_present(s):
+			self.size += 1
+		remaining = dict(value)
+		# Packed columns first.
+		if s < len(self.offsets) - 1:
+			for k in range(self.offsets[s], self.offsets[s + 1]):
+				self.counts[k] = remaining.pop(self.representations[self.rep_ids[k]], 0)
+		# Then everything else.
+		extra = {self.representations.intern(r): remaining[r] for r in remaining if remaining[r] != 0}
+		if len(extra) != 0:
+			self.overflow[s] = extra
+		else:
+			self.overflow.pop(s, None)
+		if not self.is_present(s):
+			self.size -= 1
+
+	def __delitem__(self, key):
+		s = self.substrings.find(key)
+		if s == -1 or not self.is_present(s):
+			raise KeyError(key)
+		if s < len(self.offsets) - 1:
+			for k in range(self.offsets[s], self.offsets[s + 1]):
+				self.counts[k] = 0
+		self.overflow.pop(s, None)
+		self.size -= 1
+
+	def __iter__(self):
+		for s in range(len(self.substrings)):
+			if self.is_present(s):
+				yield self.substrings[s]
+
+	def __len__(self):
+		return self.size
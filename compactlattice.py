@@ -0,0 +1,454 @@
+# A compact alternative to Lattice, for pronouncing many words (i.e. in bulk, or during cross-validation.)
+#
+# Lattice allocates a Node object per node and an Arc object (with a list of the words it came from) per arc,
+# keys both by hash((...)) (so a lookup allocates a Node even when it finds one), and links them with lists.
+# CompactLattice instead numbers nodes and arcs as they're created, and keeps them in parallel tables:
+#
+#	node_ids:        ('s', 's', 0) -> 2, ...                 (letter, phoneme, index) -> node ID
+#	node_letters, node_phonemes, node_indices               node k's letter, phoneme and index
+#	arc_ids:         (2, 'c', 4) -> 0, ...                   (from ID, intermediate phonemes, to ID) -> arc ID
+#	arc_from, arc_to, arc_phonemes, arc_counts              arc a's endpoints, intermediate phonemes and count
+#
+# Before searching, freeze() builds CSR adjacency: node k's arcs are adjacent[offsets[k]:offsets[k + 1]],
+# in the order they were created, which is the order Lattice's Node.to_arcs would list them.
+# The shortest path search (see Lattice.ShortestPaths) works on IDs, and Lattice.Node and Lattice.Arc objects are only
+# made for the arcs candidates take, so decide (and everything after it) works as it does with a Lattice.
+# The words arcs came from (Lattice.Arc.from_words) are only kept if track_words is True.
+from array import array
+from lattice import Lattice
+
+class CompactLattice(Lattice):
+	# Shortest paths from START to END, as in Lattice.ShortestPaths, by node and arc ID.
+	class ShortestPaths:
+		def __init__(self, parent):
+			parent.freeze()
+			self.parent = parent
+			node_count = len(parent.node_indices)
+			self.order = sorted(range(node_count), key=parent.node_indices.__getitem__)
+			offsets, adjacent, arc_to = parent.offsets, parent.adjacent, parent.arc_to
+			# Forward. Arcs from START (or -1 if unreached), number of shortest paths from START,
+			# and the arc ID each node was first reached by at that distance.
+			self.distance = array('i', [-1])*node_count
+			self.path_count = [0]*node_count
+			self.previous = array('i', [-1])*node_count
+			self.distance[parent.START] = 0
+			self.path_count[parent.START] = 1
+			for node in self.order:
+				if self.distance[node] < 0:
+					continue
+				distance = self.distance[node] + 1
+				for k in range(offsets[node], offsets[node + 1]):
+					neighbor = arc_to[adjacent[k]]
+					best = self.distance[neighbor]
+					if best < 0 or distance < best:
+						self.distance[neighbor] = distance
+						self.path_count[neighbor] = self.path_count[node]
+						self.previous[neighbor] = adjacent[k]
+					elif distance == best:
+						self.path_count[neighbor] += self.path_count[node]
+			self.length = self.distance[parent.END] if self.distance[parent.END] >= 0 else None
+			self.count = self.path_count[parent.END]
+			# Arcs to END (or -1 if END can't be reached.) See backward.
+			self.remaining = None
+
+		# See Lattice.ShortestPaths.backward.
+		def backward(self):
+			if self.remaining is not None:
+				return
+			parent = self.parent
+			self.remaining = array('i', [-1])*len(parent.node_indices)
+			self.remaining[parent.END] = 0
+			if self.length is None:
+				return
+			offsets, adjacent, arc_to = parent.offsets, parent.adjacent, parent.arc_to
+			for node in reversed(self.order):
+				for k in range(offsets[node], offsets[node + 1]):
+					remaining = self.remaining[arc_to[adjacent[k]]]
+					if remaining >= 0 and (self.remaining[node] < 0 or remaining + 1 < self.remaining[node]):
+						self.remaining[node] = remaining + 1
+
+		# See Lattice.ShortestPaths.only_path.
+		def only_path(self):
+			if self.count != 1:
+				return None
+			parent = self.parent
+			arcs = []
+			node = parent.END
+			while node != parent.START:
+				arcs.append(self.previous[node])
+				node = parent.arc_from[arcs[-1]]
+			arcs.reverse()
+			return [parent.arc_view(a) for a in arcs]
+
+		# Whether arc ID a lies on a shortest path.
+		def on_path(self, a):
+			distance = self.distance[self.parent.arc_from[a]]
+			remaining = self.remaining[self.parent.arc_to[a]]
+			return distance >= 0 and remaining >= 0 and distance + 1 + remaining == self.length
+
+		# The arc IDs leaving node on a shortest path, in order.
+		def arcs_on_path(self, node):
+			parent = self.parent
+			return [a for a in parent.adjacent[parent.offsets[node]:parent.offsets[node + 1]] if self.on_path(a)]
+
+		# See Lattice.ShortestPaths.paths.
+		def paths(self):
+			if self.length is None:
+				return
+			if self.count == 1:
+				yield self.only_path()
+				return
+			self.backward()
+			parent = self.parent
+			arcs = []
+			def extend(node):
+				if node == parent.END:
+					yield [parent.arc_view(a) for a in arcs]
+					return
+				for a in self.arcs_on_path(node):
+					arcs.append(a)
+					yield from extend(parent.arc_to[a])
+					arcs.pop()
+			yield from extend(parent.START)
+
+		# See Lattice.ShortestPaths.best_paths. Arc IDs stand in for positions: a node's arcs are numbered in order.
+		def best_paths(self, max_frontier=None):
+			import heapq
+			if self.length is None:
+				return
+			if self.count == 1:
+				yield self.only_path()
+				return
+			self.backward()
+			parent = self.parent
+			best = {parent.END: 1}
+			for node in reversed(self.order):
+				for a in self.arcs_on_path(node):
+					product = parent.arc_counts[a]*best[parent.arc_to[a]]
+					if node not in best or product > best[node]:
+						best[node] = product
+			heap = [(-best[parent.START], (), 1, parent.START)]
+			while heap:
+				bound, arcs, product, node = heapq.heappop(heap)
+				if node == parent.END:
+					yield [parent.arc_view(a) for a in arcs]
+					continue
+				for a in self.arcs_on_path(node):
+					extended = product*parent.arc_counts[a]
+					heapq.heappush(heap, (-extended*best[parent.arc_to[a]], arcs + (a,), extended, parent.arc_to[a]))
+				if max_frontier is not None and len(heap) > max_frontier:
+					heap = heapq.nsmallest(max(1, max_frontier//2), heap)
+
+		# See Lattice.ShortestPaths.beam_paths.
+		def beam_paths(self, B):
+			import heapq
+			if self.length is None:
+				return
+			if self.count == 1:
+				yield self.only_path()
+				return
+			self.backward()
+			parent = self.parent
+			end_index = len(parent.letters)
+			beams = {-1: [(-1, (), parent.START)]}
+			for index in range(-1, end_index + 1):
+				beam = heapq.nsmallest(B, beams.pop(index, []))
+				if index == end_index:
+					for product, arcs, node in beam:
+						yield [parent.arc_view(a) for a in arcs]
+					return
+				for product, arcs, node in beam:
+					for a in self.arcs_on_path(node):
+						to = parent.arc_to[a]
+						beams.setdefault(parent.node_indices[to], []).append((product*parent.arc_counts[a], arcs + (a,), to))
+
+		# See Lattice.ShortestPaths.order_key.
+		def order_key(self, arcs):
+			return [self.parent.arc_id(arc) for arc in arcs]
+
+		# See Lattice.ShortestPaths.totals_by_pronunciation.
+		def totals_by_pronunciation(self, pronunciations=None):
+			if self.length is None:
+				return {}
+			self.backward()
+			wanted = None if pronunciations is None else \
+				set(pronunciation[:length] for pronunciation in pronunciations for length in range(len(pronunciation) + 1))
+			parent = self.parent
+			totals = {parent.START: {'': [1, 1]}}
+			for node in self.order:
+				prefixes = totals.pop(node, None)
+				if prefixes is None:
+					continue
+				if node == parent.END:
+					return prefixes
+				for a in self.arcs_on_path(node):
+					phonemes = parent.node_phonemes[node] + parent.arc_phonemes[a]
+					reached = totals.setdefault(parent.arc_to[a], {})
+					for prefix, (path_count, product_sum) in prefixes.items():
+						if wanted is not None and prefix + phonemes not in wanted:
+							continue
+						total = reached.setdefault(prefix + phonemes, [0, 0])
+						total[0] += path_count
+						total[1] += product_sum*parent.arc_counts[a]
+			return {}
+
+	def __init__(self, letters, QUIT_THRESHOLD=1000000, track_words=False):
+		self.letters = letters
+		self.QUIT_THRESHOLD = QUIT_THRESHOLD
+		self.node_ids = {}
+		self.node_letters = []
+		self.node_phonemes = []
+		self.node_indices = array('i')
+		self.arc_ids = {}
+		self.arc_from = array('i')
+		self.arc_to = array('i')
+		self.arc_phonemes = []
+		self.arc_counts = array('q')
+		# Arc ID -> the words it came from, if track_words.
+		self.arc_words = [] if track_words else None
+		self.START = self.create_or_find_node('', '', -1)
+		self.END = self.create_or_find_node('', '', len(letters))
+		# CSR adjacency (see freeze.) None until the next search whenever arcs are added.
+		self.offsets = None
+		self.adjacent = None
+		# Node and arc ID -> Lattice.Node and Lattice.Arc, made on demand.
+		self.START_NODE = Lattice.Node('', '', -1)
+		self.END_NODE = Lattice.Node('', '', len(letters))
+		self.node_views = {self.START: self.START_NODE, self.END: self.END_NODE}
+		self.arc_views = {}
+		self.shortest_paths = None
+		self.approximate = False
+
+	# See Lattice.snapshot. Node and arc IDs are positions already.
+	def snapshot(self):
+		return (self.letters, list(zip(self.node_letters, self.node_phonemes, self.node_indices)), \
+			list(zip(self.arc_from, self.arc_phonemes, self.arc_to, self.arc_counts)))
+
+	# See Lattice.from_snapshot.
+	@staticmethod
+	def from_snapshot(snapshot, track_words=False):
+		letters, nodes, arcs = snapshot
+		pl = CompactLattice(letters, track_words=track_words)
+		nodes = [pl.create_or_find_node(*node) for node in nodes]
+		for a, inter, b, count in arcs:
+			inter_letters = letters[pl.node_indices[nodes[a]] + 1:pl.node_indices[nodes[b]]] if nodes[a] != pl.START and nodes[b] != pl.END else ''
+			pl.arc_counts[pl.create_or_iterate_arc(inter, inter_letters, nodes[a], nodes[b])] = count
+		return pl
+
+	def create_or_find_node(self, l, p, i):
+		node = self.node_ids.get((l, p, i), None)
+		if node is None:
+			node = len(self.node_indices)
+			self.node_ids[(l, p, i)] = node
+			self.node_letters.append(l)
+			self.node_phonemes.append(p)
+			self.node_indices.append(i)
+		return node
+
+	# See Lattice.create_or_iterate_arc. a and b are node IDs. Returns the arc's ID.
+	def create_or_iterate_arc(self, inter, inter_letters, a, b, word='', forced_count=0):
+		arc = self.arc_ids.get((a, inter, b), None)
+		if arc is not None:
+			if forced_count != 0:
+				print('Error. Forcing the count of a duplicate arc: {}'.format(str(self.arc_view(arc))))
+				exit()
+			# Do not iterate start or end nodes.
+			self.arc_counts[arc] += 1 if a != self.START and b != self.END else 0
+			if self.arc_words is not None:
+				self.arc_words[arc].append(word)
+			return arc
+		arc = len(self.arc_from)
+		self.arc_ids[(a, inter, b)] = arc
+		self.arc_from.append(a)
+		self.arc_to.append(b)
+		self.arc_phonemes.append(inter)
+		# Force count if applicable.
+		self.arc_counts.append(forced_count if forced_count > 1 else 1)
+		if self.arc_words is not None:
+			self.arc_words.append([word])
+		self.offsets = None
+		return arc
+
+	def add_forced(self, sub_letters, sub_phones, start_index, forced_count):
+		a = self.create_or_find_node(sub_letters[0], sub_phones[0], start_index)
+		b = self.create_or_find_node(sub_letters[-1], sub_phones[-1], start_index + len(sub_letters) - 1)
+		self.create_or_iterate_arc(sub_phones[1:-1], sub_letters[1:-1], a, b, forced_count=forced_count)
+		if start_index == 0:
+			self.create_or_iterate_arc('', '', self.START, a)
+		if start_index + len(sub_letters) == len(self.letters):
+			self.create_or_iterate_arc('', '', b, self.END)
+
+	# See Lattice.add_all_forced.
+	def add_all_forced(self, matches):
+		node_ids, arc_ids = self.node_ids, self.arc_ids
+		node_letters, node_phonemes, node_indices = self.node_letters, self.node_phonemes, self.node_indices
+		arc_from, arc_to, arc_phonemes, arc_counts, arc_words = self.arc_from, self.arc_to, self.arc_phonemes, self.arc_counts, self.arc_words
+		last = len(self.letters)
+		def node_id(key):
+			node = node_ids.get(key, None)
+			if node is None:
+				node = node_ids[key] = len(node_indices)
+				node_letters.append(key[0])
+				node_phonemes.append(key[1])
+				node_indices.append(key[2])
+			return node
+		# Start and end arcs are never iterated (see create_or_iterate_arc.)
+		def link(a, b):
+			arc = arc_ids.get((a, '', b), None)
+			if arc is None:
+				arc = arc_ids[(a, '', b)] = len(arc_from)
+				arc_from.append(a)
+				arc_to.append(b)
+				arc_phonemes.append('')
+				arc_counts.append(1)
+				if arc_words is not None:
+					arc_words.append([])
+			if arc_words is not None:
+				arc_words[arc].append('')
+		for sub_letters, sub_phones, start_index, forced_count in matches:
+			end_index = start_index + len(sub_letters) - 1
+			a = node_id((sub_letters[0], sub_phones[0], start_index))
+			b = node_id((sub_letters[-1], sub_phones[-1], end_index))
+			inter = sub_phones[1:-1]
+			arc = arc_ids.get((a, inter, b), None)
+			if arc is not None:
+				if forced_count != 0:
+					print('Error. Forcing the count of a duplicate arc: {}'.format(str(self.arc_view(arc))))
+					exit()
+				arc_counts[arc] += 1
+			else:
+				arc = arc_ids[(a, inter, b)] = len(arc_from)
+				arc_from.append(a)
+				arc_to.append(b)
+				arc_phonemes.append(inter)
+				arc_counts.append(forced_count if forced_count > 1 else 1)
+				if arc_words is not None:
+					arc_words.append([])
+			if arc_words is not None:
+				arc_words[arc].append('')
+			if start_index == 0:
+				link(self.START, a)
+			if end_index + 1 == last:
+				link(b, self.END)
+		self.offsets = None
+
+	def add(self, sub_letters, sub_phones, start_index, word=''):
+		a = self.create_or_find_node(sub_letters[0], sub_phones[0], start_index)
+		b = self.create_or_find_node(sub_letters[-1], sub_phones[-1], start_index + len(sub_letters) - 1)
+		self.create_or_iterate_arc(sub_phones[1:-1], sub_letters[1:-1], a, b, word=word)
+		if start_index == 0:
+			self.create_or_iterate_arc('', '', self.START, a)
+		if start_index + len(sub_letters) == len(self.letters):
+			self.create_or_iterate_arc('', '', b, self.END)
+
+	# Builds CSR adjacency: node k's arc IDs are adjacent[offsets[k]:offsets[k + 1]], in the order they were created.
+	def freeze(self):
+		if self.offsets is not None:
+			return
+		node_count = len(self.node_indices)
+		offsets = array('i', [0])*(node_count + 1)
+		for a in self.arc_from:
+			offsets[a + 1] += 1
+		for k in range(node_count):
+			offsets[k + 1] += offsets[k]
+		adjacent = array('i', [0])*len(self.arc_from)
+		filled = array('i', offsets)
+		for arc, a in enumerate(self.arc_from):
+			adjacent[filled[a]] = arc
+			filled[a] += 1
+		self.offsets = offsets
+		self.adjacent = adjacent
+
+	def node_view(self, node):
+		view = self.node_views.get(node, None)
+		if view is None:
+			view = Lattice.Node(self.node_letters[node], self.node_phonemes[node], self.node_indices[node])
+			self.node_views[node] = view
+		return view
+
+	# Arc ID -> Lattice.Arc, for Candidates.
+	def arc_view(self, arc):
+		view = self.arc_views.get(arc, None)
+		if view is None:
+			a, b = self.arc_from[arc], self.arc_to[arc]
+			inter_letters = self.letters[self.node_indices[a] + 1:self.node_indices[b]] if a != self.START and b != self.END else ''
+			view = Lattice.Arc(self.arc_phonemes[arc], inter_letters, self.node_view(a), self.node_view(b))
+			view.count = self.arc_counts[arc]
+			view.from_words = self.arc_words[arc] if self.arc_words is not None else []
+			self.arc_views[arc] = view
+		return view
+
+	# Lattice.Arc -> arc ID.
+	def arc_id(self, arc):
+		a = self.node_ids[(arc.from_node.matched_letter, arc.from_node.phoneme, arc.from_node.index)]
+		b = self.node_ids[(arc.to_node.matched_letter, arc.to_node.phoneme, arc.to_node.index)]
+		return self.arc_ids[(a, arc.intermediate_phonemes, b)]
+
+	# See Lattice.patch_gaps. Node IDs are in the order Lattice keeps its nodes.
+	def patch_gaps(self):
+		nodes_by_index = {}
+		for node, index in enumerate(self.node_indices):
+			nodes_by_index.setdefault(index, []).append(node)
+		reachable = {self.START}
+		# find_all_paths_legacy starts counting from index 0.
+		furthest_index = 0
+		prev_furthest_index = -1
+		index = -1
+		while True:
+			self.freeze()
+			while index <= len(self.letters):
+				for node in nodes_by_index.get(index, []):
+					if node in reachable:
+						furthest_index = max(furthest_index, index)
+						for k in range(self.offsets[node], self.offsets[node + 1]):
+							reachable.add(self.arc_to[self.adjacent[k]])
+				index += 1
+			if self.END in reachable:
+				return True
+			if furthest_index == prev_furthest_index:
+				print('Progress has stopped.')
+				return False
+			print('WARNING. No paths found. Attempting to patch gap at index {}:'.format(furthest_index))
+			patched = self.link_silences(furthest_index, nodes_by_index)
+			prev_furthest_index = furthest_index
+			index = min(patched, default=index)
+
+	# See Lattice.link_silences. nodes_by_index maps indices to node IDs.
+	def link_silences(self, furthest, nodes_by_index=None):
+		import re
+		added_count = 0
+		def link(i):
+			nonlocal added_count
+			if nodes_by_index is not None:
+				furthest_reached_nodes = list(nodes_by_index.get(i, []))
+				nodes_beyond = list(nodes_by_index.get(i + 1, []))
+			else:
+				furthest_reached_nodes = [node for node, index in enumerate(self.node_indices) if index == i]
+				nodes_beyond = [node for node, index in enumerate(self.node_indices) if index == i + 1]
+			# (letter, phoneme) of each.
+			furthest_reached_nodes = [(self.node_letters[node], self.node_phonemes[node]) for node in furthest_reached_nodes]
+			nodes_beyond = [(self.node_letters[node], self.node_phonemes[node]) for node in nodes_beyond]
+			silence = None
+			if len(nodes_beyond) == 0:
+				silence = (self.letters[i + 1], '-')
+				nodes_beyond.append(silence)
+			print('Adding {} x {} arcs'.format(len(furthest_reached_nodes), len(nodes_beyond)))
+			for from_letter, from_phoneme in furthest_reached_nodes:
+				for to_letter, to_phoneme in nodes_beyond:
+					self.add(from_letter + to_letter, from_phoneme + to_phoneme, i)
+					added_count += 1
+			if silence is not None and nodes_by_index is not None and len(furthest_reached_nodes) != 0:
+				nodes_by_index.setdefault(i + 1, []).append(self.node_ids[(silence[0], silence[1], i + 1)])
+		if furthest + 1 >= len(self.letters):
+			print('No letter follows index {}. Nothing to patch.'.format(furthest))
+			return []
+		# Get the unpaired letters by index.
+		silent_pair = self.letters[furthest] + self.letters[furthest + 1]
+		# Find every instance of the problematic letters.
+		indices = [m.start() for m in re.finditer('(?={})'.format(silent_pair), self.letters)]
+		# Patch all instances.
+		print('Instances of {}:\n{}'.format(silent_pair, indices))
+		for index in indices:
+			link(index)
+		print('Successfully added {} arcs.'.format(added_count))
+		return indices
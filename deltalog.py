@@ -0,0 +1,67 @@
+# A persisted, versioned log of changes to a lexical database, so that adding or removing a word
+# doesn't mean deleting every pickle and rebuilding from Preprocessing/Out/*.txt.
+#
+# Every change gets the next version number and is appended to the log as one line:
+#	<version>	<+ or ->	<word>	<representation>
+# Everything derived from the lexicon (the lexical and substring databases, each PatternMatcher's index)
+# remembers the latest version it includes in a small "<name>_version" file next to it (see loader.py),
+# and on load, applies whichever entries came after that.
+#
+# Compaction happens once those derived files have been rewritten with every entry folded in.
+# The live log's entries then move to an archive ("<log>_compacted") and the live log restarts,
+# its first line recording the version compacted up to:
+#	base	<version>
+# Anything built from scratch afterwards (version 0) replays the archive as well.
+class DeltaLog:
+	def __init__(self, path):
+		self.path = path
+		self.archive_path = '{}_compacted'.format(path)
+		self.base_version = 0
+		self.entries = []
+		try:
+			with open(self.path, 'r', encoding='latin-1') as f:
+				for line in f:
+					fields = line.rstrip('\n').split('\t')
+					if fields[0] == 'base':
+						self.base_version = int(fields[1])
+						continue
+					self.entries.append((int(fields[0]), fields[1], fields[2], fields[3]))
+		except FileNotFoundError:
+			pass
+
+	# The version of the most recent change.
+	def latest_version(self):
+		return self.entries[-1][0] if len(self.entries) else self.base_version
+
+	# Entries not yet folded into the derived files.
+	def pending_count(self):
+		return len(self.entries)
+
+	# Records a change. op is '+' (add word) or '-' (remove word). Returns its version.
+	def append(self, op, word, representation):
+		entry = (self.latest_version() + 1, op, word, representation)
+		with open(self.path, 'a', encoding='latin-1') as f:
+			f.write('{}\t{}\t{}\t{}\n'.format(*entry))
+		self.entries.append(entry)
+		return entry[0]
+
+	# Every entry after version, oldest first.
+	def entries_after(self, version):
+		entries = []
+		if version < self.base_version:
+			with open(self.archive_path, 'r', encoding='latin-1') as f:
+				for line in f:
+					fields = line.rstrip('\n').split('\t')
+					if int(fields[0]) > version:
+						entries.append((int(fields[0]), fields[1], fields[2], fields[3]))
+		return entries + [entry for entry in self.entries if entry[0] > version]
+
+	# Moves every live entry to the archive. Only call once every derived file includes them.
+	def compact(self):
+		with open(self.archive_path, 'a', encoding='latin-1') as f:
+			for entry in self.entries:
+				f.write('{}\t{}\t{}\t{}\n'.format(*entry))
+		self.base_version = self.latest_version()
+		self.entries = []
+		with open(self.path, 'w', encoding='latin-1') as f:
+			f.write('base\t{}\n'.format(self.base_version))
@@ -11,6 +11,7 @@ ERRORS = {
 class Lattice:
 	# Nodes are endpoints within the target word with a set location and candidate phoneme.
 	class Node:
+		__slots__ = ('matched_letter', 'phoneme', 'index', 'from_arcs', 'to_arcs', 'visited')
 		def __init__(self, matched_letter, phoneme, index):
 			self.matched_letter = matched_letter
 			self.phoneme = phoneme
@@ -32,6 +33,7 @@ class Lattice:
 			return '{}'.format(self.phoneme)
 	# Arcs span nodes with phonemes between them (or nothing, if the two nodes are bigrams.)
 	class Arc:
+		__slots__ = ('from_node', 'intermediate_phonemes', 'intermediate_letters', 'to_node', 'count', 'from_words', 'structure_component')
 		def __init__(self, intermediate_phonemes, intermediate_letters, from_node, to_node):
 			self.from_node = from_node
 			self.intermediate_phonemes = intermediate_phonemes
@@ -63,6 +65,8 @@ class Lattice:
 			return (self.from_node in list_of_nodes) or (self.to_node in list_of_nodes)				
 
 	class Candidate:
+		__slots__ = ('path', 'arcs', 'path_strings', 'pronunciation', 'arc_count_sum', 'arc_count_product', 'sum_of_products', \
+			'frequency_of_same_pronunciation', 'length', 'path_structure_standard_deviation', 'weakest_link', 'number_of_different_symbols')
 		# Initialize candidate as empty or as shallow copy.
 		def __init__(self, parent, arcs=None):
 			# Init as empty.
@@ -125,9 +129,209 @@ class Lattice:
 			self.path = self.path[:-2] # path and path_strings had [node, arc, node], three references to remove.
 			self.path_strings = self.path_strings[:-2]
 
+	# Shortest paths from START_NODE to END_NODE, by dynamic programming rather than by listing paths.
+	# The lattice is a DAG whose arcs all lead to a later index, so visiting nodes by index visits each one
+	# after every node leading into it: one pass forward gives each node's distance from START_NODE (in arcs)
+	# and how many shortest paths reach it, and one pass backward gives each node's distance to END_NODE.
+	# An arc is on a shortest path exactly when those distances add up across it, which is all paths() and
+	# totals_by_pronunciation() need to follow. Each pass is linear in the number of nodes and arcs.
+	# Most words have a single shortest path, though, and decide needs nothing but that path. The forward pass
+	# remembers the arc each node was first reached by, which when there is a single shortest path, traces it back
+	# from END_NODE (see only_path), so the backward pass is only made once something needs it.
+	class ShortestPaths:
+		def __init__(self, parent):
+			from operator import attrgetter
+			self.parent = parent
+			self.order = sorted(parent.nodes.values(), key=attrgetter('index'))
+			# Forward. Node -> arcs from START_NODE, node -> number of shortest paths from START_NODE,
+			# and node -> the arc it was first reached by at that distance.
+			self.distance = {parent.START_NODE: 0}
+			self.path_count = {parent.START_NODE: 1}
+			self.previous = {}
+			for node in self.order:
+				if node not in self.distance:
+					continue
+				distance = self.distance[node] + 1
+				for arc in node.to_arcs:
+					neighbor = arc.to_node
+					best = self.distance.get(neighbor, None)
+					if best is None or distance < best:
+						self.distance[neighbor] = distance
+						self.path_count[neighbor] = self.path_count[node]
+						self.previous[neighbor] = arc
+					elif distance == best:
+						self.path_count[neighbor] += self.path_count[node]
+			# The length of the shortest paths (in arcs, as Candidate.length counts them), or None if there are none.
+			self.length = self.distance.get(parent.END_NODE, None)
+			self.count = self.path_count.get(parent.END_NODE, 0)
+			# Node -> arcs to END_NODE. See backward.
+			self.remaining = None
+			# id(arc) -> its position among its from_node's arcs. See order_key.
+			self.positions = None
+
+		# Backward pass. Call before on_path.
+		def backward(self):
+			if self.remaining is not None:
+				return
+			self.remaining = {self.parent.END_NODE: 0}
+			if self.length is None:
+				return
+			for node in reversed(self.order):
+				for arc in node.to_arcs:
+					remaining = self.remaining.get(arc.to_node, None)
+					if remaining is not None and remaining + 1 < self.remaining.get(node, remaining + 2):
+						self.remaining[node] = remaining + 1
+
+		# The only shortest path, as a list of arcs, or None if there isn't exactly one.
+		# Every node along it has a single shortest path leading to it, so the arc it was first reached by is that path's.
+		def only_path(self):
+			if self.count != 1:
+				return None
+			arcs = []
+			node = self.parent.END_NODE
+			while node is not self.parent.START_NODE:
+				arcs.append(self.previous[node])
+				node = arcs[-1].from_node
+			arcs.reverse()
+			return arcs
+
+		# Whether arc lies on a shortest path.
+		def on_path(self, arc):
+			distance = self.distance.get(arc.from_node, None)
+			remaining = self.remaining.get(arc.to_node, None)
+			return distance is not None and remaining is not None and distance + 1 + remaining == self.length
+
+		# Yields every shortest path as a list of arcs. Each node's arcs are followed in order, so paths come out
+		# in the order breadth-first search reaches them.
+		def paths(self):
+			if self.length is None:
+				return
+			if self.count == 1:
+				yield self.only_path()
+				return
+			self.backward()
+			end = self.parent.END_NODE
+			arcs = []
+			def extend(node):
+				if node == end:
+					yield list(arcs)
+					return
+				for arc in node.to_arcs:
+					if self.on_path(arc):
+						arcs.append(arc)
+						yield from extend(arc.to_node)
+						arcs.pop()
+			yield from extend(self.parent.START_NODE)
+
+		# Yields shortest paths (each a list of arcs) lazily, from the largest arc count product down, ties in the order
+		# paths() yields them. Best-first: one pass backward gives the largest product from each node on, which makes
+		# every partial path's bound exact, so only partial paths leading to the next path are ever extended, and
+		# the k-th path costs on the order of k times the path length heap operations. Counts are assumed positive.
+		# max_frontier optionally caps how many partial paths are kept: past it, only the better half are kept,
+		# so paths still come out best first, but those that would have come out last may never come out.
+		def best_paths(self, max_frontier=None):
+			import heapq
+			if self.length is None:
+				return
+			if self.count == 1:
+				yield self.only_path()
+				return
+			self.backward()
+			start, end = self.parent.START_NODE, self.parent.END_NODE
+			# Node -> largest arc count product of the rest of a shortest path from it.
+			best = {end: 1}
+			for node in reversed(self.order):
+				for arc in node.to_arcs:
+					if self.on_path(arc):
+						product = arc.count*best[arc.to_node]
+						if node not in best or product > best[node]:
+							best[node] = product
+			# Entries are (negated bound, positions of the arcs taken among their nodes' to_arcs, product so far, node, arcs).
+			# Positions are unique, so entries never tie, and compare in the order paths() would reach them.
+			heap = [(-best[start], (), 1, start, [])]
+			while heap:
+				bound, positions, product, node, arcs = heapq.heappop(heap)
+				if node == end:
+					yield arcs
+					continue
+				for position, arc in enumerate(node.to_arcs):
+					if self.on_path(arc):
+						extended = product*arc.count
+						heapq.heappush(heap, (-extended*best[arc.to_node], positions + (position,), extended, arc.to_node, arcs + [arc]))
+				if max_frontier is not None and len(heap) > max_frontier:
+					# A sorted list is a heap already.
+					heap = heapq.nsmallest(max(1, max_frontier//2), heap)
+
+		# Yields up to B shortest paths (each a list of arcs) by beam search, the largest arc count product first.
+		# Visiting indices in order, only the B partial paths with the largest arc count products reaching each index
+		# are extended (ties in the order paths() would reach them), so however many paths there are, it costs on
+		# the order of B times the number of arcs on shortest paths. Unlike best_paths, it may miss the best paths,
+		# but when B is at least the number of shortest paths, it yields them all.
+		def beam_paths(self, B):
+			import heapq
+			if self.length is None:
+				return
+			if self.count == 1:
+				yield self.only_path()
+				return
+			self.backward()
+			start, end = self.parent.START_NODE, self.parent.END_NODE
+			# Index -> partial paths reaching a node at that index, as (negated product, positions of the arcs taken, node, arcs.)
+			beams = {start.index: [(-1, (), start, [])]}
+			for index in range(start.index, end.index + 1):
+				beam = heapq.nsmallest(B, beams.pop(index, []))
+				if index == end.index:
+					for product, positions, node, arcs in beam:
+						yield arcs
+					return
+				for product, positions, node, arcs in beam:
+					for position, arc in enumerate(node.to_arcs):
+						if self.on_path(arc):
+							beams.setdefault(arc.to_node.index, []).append((product*arc.count, positions + (position,), arc.to_node, arcs + [arc]))
+
+		# A key sorting paths into the order paths() yields them: the positions of their arcs among their nodes' arcs.
+		# Positions are looked up once for every arc, rather than scanning to_arcs for each arc of each path.
+		def order_key(self, arcs):
+			if self.positions is None:
+				self.positions = {id(arc): position for node in self.order for position, arc in enumerate(node.to_arcs)}
+			return [self.positions[id(arc)] for arc in arcs]
+
+		# Maps each pronunciation to [number of shortest paths pronouncing it, sum of those paths' arc count products]
+		# (get_frequencies_by_pronunciation's two dicts, over every shortest path) without listing the paths.
+		# Each node keeps the same pair for every pronunciation of the paths' beginnings reaching it, in one pass forward:
+		# following an arc appends its phonemes to each, keeps the path count, and multiplies the product sum by its count.
+		# pronunciations optionally limits the totals to those pronunciations: only beginnings of them are kept, so however
+		# many shortest paths there are, no node keeps more pairs than there are pronunciations.
+		def totals_by_pronunciation(self, pronunciations=None):
+			if self.length is None:
+				return {}
+			self.backward()
+			wanted = None if pronunciations is None else \
+				set(pronunciation[:length] for pronunciation in pronunciations for length in range(len(pronunciation) + 1))
+			totals = {self.parent.START_NODE: {'': [1, 1]}}
+			for node in self.order:
+				prefixes = totals.pop(node, None)
+				if prefixes is None:
+					continue
+				if node == self.parent.END_NODE:
+					return prefixes
+				for arc in node.to_arcs:
+					if not self.on_path(arc):
+						continue
+					phonemes = node.phoneme + arc.intermediate_phonemes
+					reached = totals.setdefault(arc.to_node, {})
+					for prefix, (path_count, product_sum) in prefixes.items():
+						if wanted is not None and prefix + phonemes not in wanted:
+							continue
+						total = reached.setdefault(prefix + phonemes, [0, 0])
+						total[0] += path_count
+						total[1] += product_sum*arc.count
+			return {}
+
 	# Initialize pronunciation lattice.
-	# Breadth-first search will print # candidate paths every ITERATIONS_PER_PRINT. 
-	# Breadth-first search will give up after QUIT_THRESHOLD recurrences.
+	# Legacy breadth-first search will print # candidate paths every ITERATIONS_PER_PRINT. 
+	# Legacy breadth-first search will give up after QUIT_THRESHOLD recurrences,
+	# and find_all_paths when there are more than QUIT_THRESHOLD shortest paths (unless given a budget.)
 	# The default values are tuned to terminate the dataset's longest word, "supercalifragilisticexpialidocious,"
 	# after a couple of minutes.
 	def __init__(self, letters, ITERATIONS_PER_PRINT=25000, QUIT_THRESHOLD=1000000):
@@ -144,6 +348,33 @@ class Lattice:
 		self.nodes[hash(('', '', len(letters)))] = self.END_NODE
 
 		self.unrepresented_bigrams = set()
+		# The last ShortestPaths find_all_paths computed.
+		self.shortest_paths = None
+		# Whether the last search ran out of budget before finding every path it was asked for (see find_all_paths.)
+		self.approximate = False
+
+	# The populated lattice as a tuple (letters, nodes, arcs), to save and replay later (see replay.py.)
+	# nodes lists each node as (matched letter, phoneme, index), in the order they were created, START_NODE and END_NODE first.
+	# arcs lists each arc as (from node's position in nodes, intermediate phonemes, to node's position in nodes, count),
+	# in the order they were created, so a lattice rebuilt from them lists every node's arcs in the same order.
+	def snapshot(self):
+		nodes = list(self.nodes.values())
+		position = {id(node): k for k, node in enumerate(nodes)}
+		return (self.letters, [(node.matched_letter, node.phoneme, node.index) for node in nodes], \
+			[(position[id(arc.from_node)], arc.intermediate_phonemes, position[id(arc.to_node)], arc.count) for arc in self.arcs.values()])
+
+	# Rebuilds a lattice from snapshot().
+	@staticmethod
+	def from_snapshot(snapshot):
+		letters, nodes, arcs = snapshot
+		pl = Lattice(letters)
+		nodes = [pl.create_or_find_node(*node) for node in nodes]
+		for a, inter, b, count in arcs:
+			from_node, to_node = nodes[a], nodes[b]
+			inter_letters = letters[from_node.index + 1:to_node.index] if from_node is not pl.START_NODE and to_node is not pl.END_NODE else ''
+			pl.create_or_iterate_arc(inter, inter_letters, from_node, to_node).count = count
+		return pl
+
 	# String interpretation of pronunciation lattice (unlinked. use print() for all linked pronunciations.)
 	def __str__(self):
 		s = ''
@@ -163,7 +394,9 @@ class Lattice:
 		for node in self.nodes:
 			print('Node {} has {} arcs into it and {} arcs out of it.'.format(node.matched_letter + node.phoneme + str(node.index), len(node.from_arcs), len(node.to_arcs)))
 
-	def find_all_paths(self, verbose = False):
+	# Breadth-first search over every path from START_NODE, kept to check find_all_paths against.
+	# Besides every shortest path, it may return some paths one arc longer (decide filters them out.)
+	def find_all_paths_legacy(self, verbose = False):
 		from collections import deque
 		import time
 		time_before = time.perf_counter()
@@ -231,6 +464,154 @@ class Lattice:
 		print('Found {} paths in {} seconds'.format(len(candidates), duration))
 		return candidates
 
+	# Patches gaps (see link_silences) until END_NODE can be reached, then returns the lattice's ShortestPaths.
+	# Returns NO_PATHS_FOUND if END_NODE can't be reached.
+	def find_shortest_paths(self):
+		self.approximate = False
+		if not self.patch_gaps():
+			return NO_PATHS_FOUND
+		self.shortest_paths = self.ShortestPaths(self)
+		return self.shortest_paths
+
+	# Whether END_NODE can be reached from START_NODE as the lattice stands, without patching gaps or searching.
+	def reaches_end(self):
+		reached = {self.START_NODE}
+		stack = [self.START_NODE]
+		while len(stack) != 0:
+			for arc in stack.pop().to_arcs:
+				if arc.to_node not in reached:
+					reached.add(arc.to_node)
+					stack.append(arc.to_node)
+		return self.END_NODE in reached
+
+	# Patches gaps (see link_silences) until END_NODE can be reached from START_NODE, before any search.
+	# Returns whether it can be.
+	# One sweep over nodes by index finds which are reachable (arcs only lead forward, so every arc into a node
+	# has been followed by the time the sweep gets to it.) Where the sweep runs out, the gap after the furthest index
+	# reached is patched, as find_all_paths_legacy would patch it, and the sweep picks up from the earliest index patched.
+	def patch_gaps(self):
+		nodes_by_index = {}
+		for node in self.nodes.values():
+			nodes_by_index.setdefault(node.index, []).append(node)
+		reachable = {self.START_NODE}
+		# find_all_paths_legacy starts counting from index 0.
+		furthest_index = 0
+		prev_furthest_index = -1
+		index = -1
+		while True:
+			while index <= len(self.letters):
+				for node in nodes_by_index.get(index, []):
+					if node in reachable:
+						furthest_index = max(furthest_index, index)
+						for arc in node.to_arcs:
+							reachable.add(arc.to_node)
+				index += 1
+			if self.END_NODE in reachable:
+				return True
+			if furthest_index == prev_furthest_index:
+				print('Progress has stopped.')
+				return False
+			print('WARNING. No paths found. Attempting to patch gap at index {}:'.format(furthest_index))
+			patched = self.link_silences(furthest_index, nodes_by_index)
+			prev_furthest_index = furthest_index
+			index = min(patched, default=index)
+
+	# Every shortest path from START_NODE to END_NODE as a list of Candidates, in the order find_all_paths_legacy finds them.
+	# decide ranks every candidate against every other (see rank_by_heuristics), so exact decisions still take every path
+	# listed, however fast they're found. (find_best_paths and find_beam_paths list fewer.)
+	# Returns NO_PATHS_FOUND if there are none, even after patching gaps,
+	# or SEARCHED_TOO_LONG if there are more than QUIT_THRESHOLD of them.
+	# Given a budget (a time.perf_counter() deadline and/or a cap on the search frontier), finds them best first instead
+	# (see find_best_paths), and if it runs out of budget, or there are more than QUIT_THRESHOLD of them,
+	# returns only the best found and sets self.approximate, so that decide settles for it.
+	def find_all_paths(self, verbose = False, deadline=None, max_frontier=None):
+		import time
+		if deadline is not None or max_frontier is not None:
+			return self.find_best_paths(None, verbose, deadline, max_frontier)
+		time_before = time.perf_counter()
+		shortest_paths = self.find_shortest_paths()
+		if shortest_paths == NO_PATHS_FOUND:
+			return NO_PATHS_FOUND
+		if shortest_paths.count > self.QUIT_THRESHOLD:
+			print('{} shortest paths found. Giving up.'.format(shortest_paths.count))
+			return SEARCHED_TOO_LONG
+
+		candidates = []
+		if verbose:
+			print('CANDIDATES FOUND:')
+		for path in shortest_paths.paths():
+			candidates.append(self.Candidate(self, path))
+			if verbose:
+				print("{}, length: {}".format(candidates[-1].pronunciation, len(candidates[-1].arcs)))
+
+		duration = time.perf_counter() - time_before
+		print('Found {} paths in {} seconds'.format(len(candidates), duration))
+		return candidates
+
+	# find_all_paths, but only the k shortest paths with the largest arc count products (see ShortestPaths.best_paths),
+	# however many shortest paths there are. They're listed in the order find_all_paths would list them,
+	# so when k covers every shortest path, decide comes to the same decisions.
+	# Stops early (always with at least one path) past deadline, a time.perf_counter() time, and keeps at most
+	# about max_frontier partial paths (see ShortestPaths.best_paths.) If either cut it short, sets self.approximate and returns
+	# only the best path found, the one decide settles for then.
+	# k None asks for every path, or only the best if there are more than QUIT_THRESHOLD of them (also approximate.)
+	def find_best_paths(self, k, verbose = False, deadline=None, max_frontier=None):
+		import time
+		time_before = time.perf_counter()
+		shortest_paths = self.find_shortest_paths()
+		if shortest_paths == NO_PATHS_FOUND:
+			return NO_PATHS_FOUND
+		wanted = shortest_paths.count if k is None else min(k, shortest_paths.count)
+		if k is None:
+			k = wanted if wanted <= self.QUIT_THRESHOLD else 1
+		paths = []
+		for path in shortest_paths.best_paths(max_frontier):
+			paths.append(path)
+			if len(paths) == k or (deadline is not None and time.perf_counter() > deadline):
+				break
+		if len(paths) < wanted:
+			print('Settling for {} of {} paths.'.format(len(paths), wanted))
+			self.approximate = True
+			# decide settles for the largest arc count product, the first path found, so the rest aren't sorted or made Candidates.
+			paths = paths[:1]
+		else:
+			paths.sort(key=shortest_paths.order_key)
+
+		candidates = []
+		if verbose:
+			print('CANDIDATES FOUND:')
+		for path in paths:
+			candidates.append(self.Candidate(self, path))
+			if verbose:
+				print("{}, length: {}".format(candidates[-1].pronunciation, len(candidates[-1].arcs)))
+
+		duration = time.perf_counter() - time_before
+		print('Found {} of {} paths in {} seconds'.format(len(candidates), shortest_paths.count, duration))
+		return candidates
+
+	# find_all_paths, but only the shortest paths a beam search B partial paths wide finds (see ShortestPaths.beam_paths),
+	# listed in the order find_all_paths would list them.
+	def find_beam_paths(self, B, verbose = False):
+		import time
+		time_before = time.perf_counter()
+		shortest_paths = self.find_shortest_paths()
+		if shortest_paths == NO_PATHS_FOUND:
+			return NO_PATHS_FOUND
+		paths = list(shortest_paths.beam_paths(B))
+		paths.sort(key=shortest_paths.order_key)
+
+		candidates = []
+		if verbose:
+			print('CANDIDATES FOUND:')
+		for path in paths:
+			candidates.append(self.Candidate(self, path))
+			if verbose:
+				print("{}, length: {}".format(candidates[-1].pronunciation, len(candidates[-1].arcs)))
+
+		duration = time.perf_counter() - time_before
+		print('Beam search found {} of {} paths in {} seconds'.format(len(candidates), shortest_paths.count, duration))
+		return candidates
+
 	# Count identical pronunciations generating
 	# 1) "the maximum frequency of the same pronunciation (FSP) within the shortest paths," and
 	# 2) "the sum of products over...multiple paths [of] identical pronunciations"
@@ -247,8 +628,64 @@ class Lattice:
 				pronunciation_to_sum_of_product.get(candidate.pronunciation, 0) + candidate.arc_count_product
 		return pronunciation_to_repeat_count, pronunciation_to_sum_of_product
 
+	# Returns get_frequencies_by_pronunciation's two dicts for candidates, as if every shortest path were listed.
+	# When candidates are only some of the shortest paths (see find_best_paths and find_beam_paths), the frequencies
+	# and sums of products still count the rest, from the totals over every shortest path (see
+	# ShortestPaths.totals_by_pronunciation), without listing them. Only the candidates' pronunciations are totaled, so this
+	# costs on the order of the number of candidates times the lattice's size. When they're all of them, tallying them is enough.
+	def frequencies_by_pronunciation(self, candidates):
+		if self.shortest_paths is None or self.shortest_paths.count == len(candidates):
+			return self.get_frequencies_by_pronunciation(candidates)
+		totals = self.shortest_paths.totals_by_pronunciation(set(candidate.pronunciation for candidate in candidates))
+		pronunciation_to_repeat_count = {pronunciation: totals[pronunciation][0] for pronunciation in totals}
+		pronunciation_to_sum_of_product = {pronunciation: totals[pronunciation][1] for pronunciation in totals}
+		return pronunciation_to_repeat_count, pronunciation_to_sum_of_product
+
 	# These help break ties. See page 9 of "Can syllabification improve pronunciation by analogy of English?"
+	# Computes the same heuristics as compute_heuristics_legacy, a heuristic at a time for every candidate at once,
+	# in time linear in the number of candidates rather than quadratic (words with thousands of tied shortest paths.)
 	def compute_heuristics(self, candidates):
+		import math
+		import statistics
+		# 1. Maximum arc count product
+		for candidate in candidates:
+			candidate.arc_count_product = math.prod([arc.count for arc in candidate.arcs])
+
+		# 2. Minimum standard deviation.
+		# Tied candidates mostly share their path structures, and statistics.stdev is slow (it's exact), so it's
+		# computed once per structure. Sorting doesn't change the result: the sums it takes are exact.
+		structure_to_standard_deviation = {}
+		for candidate in candidates:
+			structure = tuple(sorted(arc.structure_component for arc in candidate.arcs))
+			if structure not in structure_to_standard_deviation:
+				structure_to_standard_deviation[structure] = statistics.stdev(structure)
+			candidate.path_structure_standard_deviation = structure_to_standard_deviation[structure]
+
+		# 3. Maximum frequency of the same pronunciation 
+		# (We'll also do sum of products here, too, even though it's not one of M&D's 5.)
+		pronunciation_to_repeat_count, pronunciation_to_sum_of_product = self.frequencies_by_pronunciation(candidates)
+		for candidate in candidates:
+			candidate.frequency_of_same_pronunciation = pronunciation_to_repeat_count[candidate.pronunciation]
+			candidate.sum_of_products = pronunciation_to_sum_of_product[candidate.pronunciation]
+
+		# 4. Minimum number of different symbols per candidate.
+		# Every pronunciation is as long as the word, so at each index, a candidate differs from every competitor
+		# but those sharing its symbol there: len(candidates) minus that symbol's count at that index.
+		symbol_counts_by_index = [{} for _ in range(len(self.letters))]
+		for candidate in candidates:
+			for symbol_counts, ch in zip(symbol_counts_by_index, candidate.pronunciation):
+				symbol_counts[ch] = symbol_counts.get(ch, 0) + 1
+		for candidate in candidates:
+			candidate.number_of_different_symbols = sum(len(candidates) - symbol_counts[ch] \
+				for symbol_counts, ch in zip(symbol_counts_by_index, candidate.pronunciation))
+
+		# 5. Maximum weakest link. (The weakest link is the minimum arc count)
+		# Paths always start with their start arc and end with their end arc.
+		for candidate in candidates:
+			candidate.weakest_link = min([arc.count for arc in candidate.arcs[1:-1]])
+
+	# compute_heuristics as M&D describe them, a candidate at a time. Kept to check compute_heuristics against.
+	def compute_heuristics_legacy(self, candidates):
 		import math
 		import statistics
 		from operator import attrgetter
@@ -256,7 +693,7 @@ class Lattice:
 		for i in range(len(candidates)):
 			candidates[i].arc_count_product = math.prod([arc.count for arc in candidates[i].arcs])
 
-		pronunciation_to_repeat_count, pronunciation_to_sum_of_product = self.get_frequencies_by_pronunciation(candidates)
+		pronunciation_to_repeat_count, pronunciation_to_sum_of_product = self.frequencies_by_pronunciation(candidates)
 
 		other_candidates_symbols = ''
 		for i in range(len(candidates)):
@@ -286,8 +723,61 @@ class Lattice:
 
 		#print(['{}: {}'.format(arc.from_node.matched_letter + arc.intermediate_phonemes + arc.to_node.matched_letter, arc.count) for arc in self.arcs])
 
-	# Ranks candidates by the five heuristics. 
+	# Ranks candidates by the five heuristics, returning the same results as rank_by_heuristics_legacy.
+	# Instead of a dict of points per heuristic, each candidate gets a row of points (one per heuristic) in a
+	# candidates x 5 matrix, and every fusion's product is built from a smaller one's: a fusion's product is that of
+	# the same fusion without its last heuristic, times that heuristic's points. That's one multiplication per
+	# fusion per candidate, each in the same order the legacy method multiplies in, so products (and ties) are the same.
 	def rank_by_heuristics(self, candidates):
+		from operator import attrgetter
+		# Rank according to these five heuristics and orders.
+		heuristic = ['arc_count_product', \
+			'path_structure_standard_deviation', \
+			'frequency_of_same_pronunciation', \
+			'number_of_different_symbols', \
+			'weakest_link']
+		descending = [True, False, True, False, True]
+
+		# Candidate -> its row of points.
+		rows = {id(candidate): [0]*len(heuristic) for candidate in candidates}
+		points_awarded_to_first = len(candidates)
+		for i in range(len(heuristic)):
+			# Sorts candidates in place, just as rank_by_heuristic does: later sorts break ties in the order of earlier ones.
+			candidates.sort(key=attrgetter(heuristic[i]), reverse=descending[i])
+			# See rank_to_score. Tied candidates share the points their places would have been awarded.
+			start = 0
+			while start < len(candidates):
+				value = getattr(candidates[start], heuristic[i])
+				end = start + 1
+				while end < len(candidates) and getattr(candidates[end], heuristic[i]) == value:
+					end += 1
+				points = sum(points_awarded_to_first - n for n in range(start, end))/(end - start)
+				for n in range(start, end):
+					rows[id(candidates[n])][i] = points
+				start = end
+		matrix = [rows[id(candidate)] for candidate in candidates]
+
+		# Rank fusion.
+		# There are 31 possible rank fusions, i.e.:
+		# 00001, 00011, 00101, ..., 10111, 01111, 11111
+		# Fusion m is labeled by its bits, the leftmost being heuristic 0. Its lowest bit is its last heuristic.
+		fusions = range(1, 2**len(heuristic))
+		labels = ['{:0{}b}'.format(m, len(heuristic)) for m in fusions]
+		last = [len(heuristic) - (m & -m).bit_length() for m in fusions]
+		best_rows = [0]*len(fusions)
+		best_products = [None]*len(fusions)
+		for r, row in enumerate(matrix):
+			products = [1]*(len(fusions) + 1)
+			for m in fusions:
+				products[m] = products[m & (m - 1)]*row[last[m - 1]]
+				# max keeps the first of tied candidates.
+				if best_products[m - 1] is None or products[m] > best_products[m - 1]:
+					best_products[m - 1] = products[m]
+					best_rows[m - 1] = r
+		return {label: candidates[best_rows[k]] for k, label in enumerate(labels)}
+
+	# rank_by_heuristics, a heuristic and a fusion at a time. Kept to check rank_by_heuristics against.
+	def rank_by_heuristics_legacy(self, candidates):
 		import itertools
 		# Rank according to these five heuristics and orders.
 		heuristic = ['arc_count_product', \
@@ -448,7 +938,11 @@ class Lattice:
 		elif len(candidates) == 0:
 			print('Candidates list is empty.')
 			return
-
+		if self.approximate:
+			# The search ran out of budget, so heuristics would only rank some of the paths.
+			# Settle for the largest arc count product, the first path the search found (see ShortestPaths.best_paths.)
+			import math
+			return {'approximate': max(candidates, key=lambda candidate: math.prod([arc.count for arc in candidate.arcs]))}
 		
 		# Find the minimum length among the candidates
 		#min_length = min(candidates, key=attrgetter('length')).length
@@ -579,6 +1073,12 @@ class Lattice:
 		self.nodes[hash((l, p, i))] = new # Not found. Add new one.
 		return new 	# Return it.
 
+	# Removes arc, i.e. when the match it came from changes (see TypeAhead.) Leaves its nodes, even without arcs.
+	def remove_arc(self, arc):
+		del self.arcs[hash((arc.intermediate_phonemes, arc.from_node, arc.to_node))]
+		arc.from_node.to_arcs.remove(arc)
+		arc.to_node.from_arcs.remove(arc)
+
 	# Adds phonemes with a precalculated count. Yeah, I could overload add, but multiprocessing 
 	# passes in a tuple of arguments with no regard for default arguments' names, and I don't want
 	# that to cause issues (like "word" being mistaken for "forced_count" or vice versa).
@@ -591,6 +1091,80 @@ class Lattice:
 		if start_index + len(sub_letters) == len(self.letters):
 			end_arc = self.create_or_iterate_arc('', '', b, self.END_NODE)
 
+	# Adds every match (a tuple of add_forced's arguments, as populate_optimized returns them) in one pass.
+	# Builds the same lattice as calling add_forced on each in turn, creating nodes and arcs in the same order,
+	# but without allocating a Node or Arc per lookup. Keys are hashed as create_or_find_node and create_or_iterate_arc
+	# hash them (arcs by their Node objects), so that arcs added later (i.e. by link_silences) find these.
+	def add_all_forced(self, matches):
+		nodes, arcs = self.nodes, self.arcs
+		Node, Arc = Lattice.Node, Lattice.Arc
+		last = len(self.letters)
+		# Start and end arcs are never iterated (see create_or_iterate_arc.)
+		def link(a, b):
+			arc_key = hash(('', a, b))
+			arc = arcs.get(arc_key, None)
+			if arc is None:
+				arc = arcs[arc_key] = Arc('', '', a, b)
+				a.to_arcs.append(arc)
+				b.from_arcs.append(arc)
+			arc.from_words.append('')
+		for sub_letters, sub_phones, start_index, forced_count in matches:
+			end_index = start_index + len(sub_letters) - 1
+			a_key = hash((sub_letters[0], sub_phones[0], start_index))
+			a = nodes.get(a_key, None)
+			if a is None:
+				a = nodes[a_key] = Node(sub_letters[0], sub_phones[0], start_index)
+			b_key = hash((sub_letters[-1], sub_phones[-1], end_index))
+			b = nodes.get(b_key, None)
+			if b is None:
+				b = nodes[b_key] = Node(sub_letters[-1], sub_phones[-1], end_index)
+			inter = sub_phones[1:-1]
+			arc_key = hash((inter, a, b))
+			arc = arcs.get(arc_key, None)
+			if arc is not None:
+				if forced_count != 0:
+					print('Error. Forcing the count of a duplicate arc: {}'.format(str(arc)))
+					exit()
+				arc.count += 1
+			else:
+				arc = arcs[arc_key] = Arc(inter, sub_letters[1:-1], a, b)
+				a.to_arcs.append(arc)
+				b.from_arcs.append(arc)
+				if forced_count > 1:
+					arc.count = forced_count
+			arc.from_words.append('')
+			if start_index == 0:
+				link(self.START_NODE, a)
+			if end_index + 1 == last:
+				link(b, self.END_NODE)
+
+	# Checks that add_all_forced builds the same lattice as add_forced called on each match in turn, for each
+	# (letters, matches) pair (matches as populate_optimized returns them): the same node and arc keys, in the same order,
+	# with the same counts and arcs, both as built and after find_all_paths patches any gaps. Returns the letters that disagree.
+	@staticmethod
+	def test_add_all_forced(lattices, print_every=1000):
+		def describe(pl):
+			return (list(pl.nodes), list(pl.arcs), [(str(arc), arc.from_words) for arc in pl.arcs.values()], \
+				[[str(arc) for arc in node.to_arcs] for node in pl.nodes.values()])
+		failures = []
+		count = 0
+		for count, (letters, matches) in enumerate(lattices, 1):
+			if count%print_every == 0:
+				print('{} lattices tested. {} failures.'.format(count, len(failures)))
+			one_at_a_time = Lattice(letters)
+			for match in matches:
+				one_at_a_time.add_forced(*match)
+			all_at_once = Lattice(letters)
+			all_at_once.add_all_forced(matches)
+			agree = describe(one_at_a_time) == describe(all_at_once)
+			one_at_a_time.find_all_paths()
+			all_at_once.find_all_paths()
+			if not agree or describe(one_at_a_time) != describe(all_at_once):
+				print('WARNING. add_all_forced and add_forced disagree on {}.'.format(letters))
+				failures.append(letters)
+		print('Test complete. {} out of {} lattices disagreed.'.format(len(failures), count))
+		return failures
+
 	def add(self, sub_letters, sub_phones, start_index, word=''):
 		a = self.create_or_find_node(sub_letters[0], sub_phones[0], start_index) # Local start.
 		b = self.create_or_find_node(sub_letters[-1], sub_phones[-1], start_index + len(sub_letters) - 1) # Local end.
@@ -604,7 +1178,9 @@ class Lattice:
 	# Fix the silence problem.
 	# Every node at index furthest should link to every node at furthest + 1.
 	# If there is no node at a given index, add one.
-	def link_silences(self, furthest):
+	# nodes_by_index optionally maps each index to its nodes (in the order of self.nodes), saving a scan over every node,
+	# and is kept up to date. Returns the indices patched.
+	def link_silences(self, furthest, nodes_by_index=None):
 		import re
 		# Link every node at index i to every node at index i + 1.
 		added_count = 0
@@ -612,20 +1188,32 @@ class Lattice:
 			nonlocal added_count
 			furthest_reached_nodes = []
 			nodes_beyond = []
-			for hash_ in self.nodes:
-				if self.nodes[hash_].index == i:
-					furthest_reached_nodes.append(self.nodes[hash_])
-				elif self.nodes[hash_].index == i + 1:
-					nodes_beyond.append(self.nodes[hash_])
+			if nodes_by_index is not None:
+				furthest_reached_nodes = list(nodes_by_index.get(i, []))
+				nodes_beyond = list(nodes_by_index.get(i + 1, []))
+			else:
+				for hash_ in self.nodes:
+					if self.nodes[hash_].index == i:
+						furthest_reached_nodes.append(self.nodes[hash_])
+					elif self.nodes[hash_].index == i + 1:
+						nodes_beyond.append(self.nodes[hash_])
+			silence = None
 			if len(nodes_beyond) == 0:
 				# TODO: Get this to work with Syllabification (which does not expect '-')
-				nodes_beyond.append(self.Node(self.letters[i + 1], '-', i + 1))
+				silence = self.Node(self.letters[i + 1], '-', i + 1)
+				nodes_beyond.append(silence)
 			print('Adding {} x {} arcs'.format(len(furthest_reached_nodes), len(nodes_beyond)))
 			for from_node in furthest_reached_nodes:
 				for to_node in nodes_beyond:
 					self.add(from_node.matched_letter + to_node.matched_letter, \
 						from_node.phoneme + to_node.phoneme, i)
 					added_count += 1
+			if silence is not None and nodes_by_index is not None and len(furthest_reached_nodes) != 0:
+				nodes_by_index.setdefault(i + 1, []).append(self.nodes[hash((silence.matched_letter, silence.phoneme, silence.index))])
+		# A gap after the last letter (as in a one-letter, unpadded word) has nothing to link to.
+		if furthest + 1 >= len(self.letters):
+			print('No letter follows index {}. Nothing to patch.'.format(furthest))
+			return []
 		# Get the unpaired letters by index.
 		silent_pair = self.letters[furthest] + self.letters[furthest + 1]
 		# Find every instance of the problematic letters.
@@ -635,3 +1223,4 @@ class Lattice:
 		for index in indices:
 			link(index)
 		print('Successfully added {} arcs.'.format(added_count))
+		return indices
@@ -17,3 +17,16 @@ def write(folder, name, data):
 	f = open('{}{}'.format(folder, name), 'wb')
 	pickle.dump(data, f)
 	f.close()
+
+# The delta log version (see deltalog.py) that file name includes, stored alongside it as <name>_version.
+# Files without one predate the delta log, and include version 0: the lexicon as preprocessed.
+def load_version(folder, name):
+	try:
+		with open('{}{}_version'.format(folder, name), 'r') as f:
+			return int(f.read())
+	except (FileNotFoundError, ValueError):
+		return 0
+
+def write_version(folder, name, version):
+	with open('{}{}_version'.format(folder, name), 'w') as f:
+		f.write(str(version))
@@ -0,0 +1,166 @@
+# A read-only, memory-mapped alternative to PatternMatcher's flat substring_to_alt_domain_count_dict.
+#
+# Unpickling the optimization dict means rebuilding every substring, inner dict and count as a Python
+# object in every process that loads it. MappedIndex instead opens a file laid out as flat tables and
+# searches it in place with mmap, so nothing is deserialized at startup, and every process on a host
+# shares the same physical pages of that file through the OS page cache.
+#
+# File layout (a little-endian header, then tables of unsigned 32-bit integers in the byte order the header names):
+#
+#	header           magic, byte order, and the four sizes below
+#	key_offsets      key k is key_blob[key_offsets[k]:key_offsets[k + 1]]        (key_count + 1)
+#	entry_offsets    key k owns entries entry_offsets[k]:entry_offsets[k + 1]   (key_count + 1)
+#	rep_offsets      entry e's representation is rep_blob[rep_offsets[e]:...]   (entry_count + 1)
+#	counts           entry e's count                                             (entry_count)
+#	key_blob         every substring, sorted, back to back
+#	rep_blob         every entry's representation, back to back
+#
+# Keys are sorted so a substring is found by binary search. Entries keep each inner dict's order.
+# Strings are stored as latin-1, which is how the lexical databases are read in the first place.
+from array import array
+from collections.abc import Mapping
+import mmap
+import struct
+import sys
+
+MAGIC = b'PBAIDX01'
+HEADER = struct.Struct('<8s8sQQQQ')
+
+class MappedIndex(Mapping):
+	# Writes any dict-like optimization dict (flat dict, SubstringTrie, CompactIndex...) to path.
+	@staticmethod
+	def write(path, d):
+		keys = sorted(d, key=lambda key: key.encode('latin-1'))
+		key_offsets = array('I', [0])
+		entry_offsets = array('I', [0])
+		rep_offsets = array('I', [0])
+		counts = array('I')
+		key_blob = []
+		rep_blob = []
+		for key in keys:
+			encoded = key.encode('latin-1')
+			key_blob.append(encoded)
+			key_offsets.append(key_offsets[-1] + len(encoded))
+			entry = d[key]
+			for representation in entry:
+				encoded = representation.encode('latin-1')
+				rep_blob.append(encoded)
+				rep_offsets.append(rep_offsets[-1] + len(encoded))
+				counts.append(entry[representation])
+			entry_offsets.append(len(counts))
+		key_blob = b''.join(key_blob)
+		rep_blob = b''.join(rep_blob)
+		with open(path, 'wb') as f:
+			f.write(HEADER.pack(MAGIC, sys.byteorder.encode().ljust(8), len(keys), len(counts), len(key_blob), len(rep_blob)))
+			for table in (key_offsets, entry_offsets, rep_offsets, counts):
+				f.write(table.tobytes())
+			f.write(key_blob)
+			f.write(rep_blob)
+
+	def __init__(self, path):
+		self.path = path
+		self.open()
+
+	def open(self):
+		with open(self.path, 'rb') as f:
+			self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, byteorder, key_count, entry_count, key_blob_size, rep_blob_size = HEADER.unpack_from(self.mm, 0)
+		if magic != MAGIC:
+			raise ValueError('{} is not a MappedIndex file.'.format(self.path))
+		if byteorder.strip() != sys.byteorder.encode():
+			raise ValueError('{} was written on a {}-endian host.'.format(self.path, byteorder.strip().decode()))
+		self.key_count = key_count
+		# Zero-copy views of each table.
+		view = memoryview(self.mm)
+		position = HEADER.size
+		def take(count):
+			nonlocal position
+			table = view[position:position + 4*count].cast('I')
+			position += 4*count
+			return table
+		self.key_offsets = take(key_count + 1)
+		self.entry_offsets = take(key_count + 1)
+		self.rep_offsets = take(entry_count + 1)
+		self.counts = take(entry_count)
+		self.key_blob_start = position
+		self.rep_blob_start = position + key_blob_size
+
+	# Only the path is pickled. Unpickling (i.e. in a multiprocessing worker) maps the same file again.
+	def __getstate__(self):
+		return {'path': self.path}
+	def __setstate__(self, state):
+		self.path = state['path']
+		self.open()
+
+	# The k-th key, as bytes.
+	def key_at(self, k):
+		start = self.key_blob_start
+		return self.mm[start + self.key_offsets[k]:start + self.key_offsets[k + 1]]
+
+	def __getitem__(self, key):
+		entry = self.get(key, None)
+		if entry is None:
+			raise KeyError(key)
+		return entry
+
+	# Binary search. Index of the first key >= encoded at or after lo.
+	def search(self, encoded, lo=0):
+		hi = self.key_count
+		while lo < hi:
+			mid = (lo + hi)//2
+			if self.key_at(mid) < encoded:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	# The inner dict of the k-th key.
+	def entry(self, k):
+		start = self.rep_blob_start
+		entry = {}
+		for e in range(self.entry_offsets[k], self.entry_offsets[k + 1]):
+			representation = self.mm[start + self.rep_offsets[e]:start + self.rep_offsets[e + 1]].decode('latin-1')
+			entry[representation] = self.counts[e]
+		return entry
+
+	def get(self, key, default=None):
+		encoded = key.encode('latin-1')
+		k = self.search(encoded)
+		if k == self.key_count or self.key_at(k) != encoded:
+			return default
+		return self.entry(k)
+
+	# Returns a dict of the form {(substring, index within input_word): inner dict}
+	# for every substring of input_word (of length 2 or more) present in the index.
+	def find_substrings(self, input_word):
+		found = {}
+		encoded_word = input_word.encode('latin-1')
+		for i in range(len(encoded_word) - 1):
+			# Every extension of a key sorts after it, so each search can start where the last one ended.
+			lo = 0
+			for j in range(i + 2, len(encoded_word) + 1):
+				encoded = encoded_word[i:j]
+				lo = self.search(encoded, lo)
+				# Every longer substring starting at i is missing, too.
+				if lo == self.key_count or self.key_at(lo) != encoded:
+					break
+				found[(input_word[i:j], i)] = self.entry(lo)
+		return found
+
+	def __iter__(self):
+		for k in range(self.key_count):
+			yield self.key_at(k).decode('latin-1')
+
+	def __len__(self):
+		return self.key_count
+
+# Converts a pickled optimization dict (as written by loader.write) into a MappedIndex file
+# named <name>_mmap in the same folder. Returns the MappedIndex.
+def convert(folder, name):
+	import loader as l
+	d = l.load(folder, name)
+	if d is None:
+		return None
+	print('Writing {}_mmap...'.format(name))
+	MappedIndex.write('{}{}_mmap'.format(folder, name), d)
+	return MappedIndex('{}{}_mmap'.format(folder, name))
@@ -1,14 +1,137 @@
+# Ways to store substring_to_alt_domain_count_dict.
+# 'dict' is a flat dict with one key per substring.
+# 'trie' is a SubstringTrie, which shares prefixes between substrings and lets populate_optimized
+# stop looking at a starting index as soon as a prefix is missing.
+# 'compact' is a CompactIndex, which interns substrings and representations to integer IDs
+# and keeps their counts in typed arrays.
+# 'mmap' is a read-only MappedIndex, searched in place on disk instead of being unpickled.
+# Use populate_optimized's exclude (not remove and replace) to leave words out of it.
+# 'sharded' is a ShardedIndex, saved as one pickle per leading character and loaded a shard at a time
+# on first use, for short-lived processes that only pronounce a few words.
+# 'suffixarray' is a read-only SuffixArrayIndex, which keeps the lexicon and a suffix array over it instead of
+# every substring, and counts each substring's representations when it's looked up. It's built from the lexicon,
+# without generating the optimization dict at all.
+BACKENDS = ['dict', 'trie', 'compact', 'mmap', 'sharded', 'suffixarray']
+# Backends that can't be changed in place (by replace, remove or apply_delta.) save rebuilds them instead.
+READ_ONLY_BACKENDS = ['mmap', 'suffixarray']
+
+# Fingerprints (see PatternMatcher.compute_fingerprint) are kept to 64 bits.
+FINGERPRINT_MASK = 2**64 - 1
+
 class PatternMatcher:
 	# Loads optimized dict for that lexicon if one exists, else optimizes that lexicon.
-	def __init__(self, word_to_alt_domain_dict, output_folder, formatted_name, use_padding, skip_every=-1, offset = 0):
+	# build_processes > 1 builds a missing optimization dict with a process pool.
+	# lexicon_version is the delta log version (see deltalog.py) word_to_alt_domain_dict includes.
+	# max_length and max_representations prune the optimization dict (see prune.)
+	def __init__(self, word_to_alt_domain_dict, output_folder, formatted_name, use_padding, skip_every=-1, offset = 0, backend='dict', build_processes=1, lexicon_version=0, \
+		max_length=None, max_representations=None):
 		import loader as l
-		# Check for previous optimization dict and load it if applicable.
-		self.substring_to_alt_domain_count_dict = l.load(output_folder, formatted_name)
+		if backend not in BACKENDS:
+			print('Unknown backend "{}". Expected one of {}.'.format(backend, BACKENDS))
+			exit()
+		self.backend = backend
+		self.output_folder = output_folder
+		self.use_padding = use_padding
+		self.max_length = max_length
+		self.max_representations = max_representations
+		self.pruned = max_length is not None or max_representations is not None
+		# Append pruning settings if applicable.
+		formatted_name = formatted_name + '_max-length-' + str(max_length) if max_length is not None else formatted_name
+		formatted_name = formatted_name + '_max-representations-' + str(max_representations) if max_representations is not None else formatted_name
+		# The file this backend's index is saved as.
+		self.index_name = formatted_name if backend == 'dict' else '{}_{}'.format(formatted_name, backend)
+		# Loads the flat optimization dict, generating (and saving) it first if needed.
+		def load_or_generate():
+			d = l.load(output_folder, formatted_name)
+			if d is None:
+				d = PatternMatcher.generate_optimization_dict(word_to_alt_domain_dict, processes=build_processes, \
+					max_length=max_length, max_representations=max_representations)
+				l.write(output_folder, formatted_name, d)
+				l.write_version(output_folder, formatted_name, lexicon_version)
+			return d
+
+		if backend == 'mmap':
+			import os
+			from mappedindex import MappedIndex
+			path = '{}{}'.format(output_folder, self.index_name)
+			if not os.path.exists(path):
+				# Convert the flat dict.
+				d = load_or_generate()
+				print('Converting {} to backend "{}"...'.format(formatted_name, backend))
+				MappedIndex.write(path, d)
+				l.write_version(output_folder, self.index_name, l.load_version(output_folder, formatted_name))
+			self.substring_to_alt_domain_count_dict = MappedIndex(path)
+		elif backend == 'sharded':
+			import os
+			from shardedindex import ShardedIndex
+			path = '{}{}'.format(output_folder, self.index_name)
+			if not os.path.exists(os.path.join(path, 'manifest')):
+				# Convert the flat dict.
+				d = load_or_generate()
+				print('Converting {} to backend "{}"...'.format(formatted_name, backend))
+				ShardedIndex.write(path, d)
+				l.write_version(output_folder, self.index_name, l.load_version(output_folder, formatted_name))
+			self.substring_to_alt_domain_count_dict = ShardedIndex(path)
+		elif backend == 'suffixarray':
+			self.substring_to_alt_domain_count_dict = l.load(output_folder, self.index_name)
+			if self.substring_to_alt_domain_count_dict is None:
+				from suffixarray import SuffixArrayIndex
+				self.substring_to_alt_domain_count_dict = SuffixArrayIndex(word_to_alt_domain_dict, max_length, max_representations)
+				l.write(output_folder, self.index_name, self.substring_to_alt_domain_count_dict)
+				l.write_version(output_folder, self.index_name, lexicon_version)
+		elif backend != 'dict':
+			self.substring_to_alt_domain_count_dict = l.load(output_folder, self.index_name)
+			if self.substring_to_alt_domain_count_dict is None:
+				# Convert the flat dict.
+				d = load_or_generate()
+				print('Converting {} to backend "{}"...'.format(formatted_name, backend))
+				self.substring_to_alt_domain_count_dict = PatternMatcher.convert(d, backend)
+				l.write(output_folder, self.index_name, self.substring_to_alt_domain_count_dict)
+				l.write_version(output_folder, self.index_name, l.load_version(output_folder, formatted_name))
+		else:
+			# Check for previous optimization dict and load it if applicable.
+			self.substring_to_alt_domain_count_dict = load_or_generate()
+		# The latest delta log version this index includes.
+		self.version = l.load_version(output_folder, self.index_name)
+		# Computed on first use (see get_fingerprint.)
+		self.fingerprint = None
+
+	# Applies one delta log entry (see deltalog.py): op '+' adds word, '-' removes it.
+	# Returns False if this backend can't be changed in place.
+	def apply_delta(self, version, op, word, altrep):
+		if self.backend in READ_ONLY_BACKENDS:
+			return False
+		if op == '+':
+			self.replace(word, altrep)
+		else:
+			self.remove(word, altrep)
+		self.version = version
+		return True
 
-		if self.substring_to_alt_domain_count_dict is None:
-			self.substring_to_alt_domain_count_dict = \
-				PatternMatcher.generate_optimization_dict(word_to_alt_domain_dict)
-			l.write(output_folder, formatted_name, self.substring_to_alt_domain_count_dict)
+	# Saves the index (and the delta log version it includes) over its file.
+	# Read-only backends can't be changed in place, so they're rebuilt from word_to_alt_domain_dict instead.
+	def save(self, word_to_alt_domain_dict=None, version=None):
+		import loader as l
+		if self.backend == 'mmap':
+			import os
+			from mappedindex import MappedIndex
+			path = '{}{}'.format(self.output_folder, self.index_name)
+			# Write a new file and swap it in: the current one is still mapped.
+			MappedIndex.write(path + '_tmp', PatternMatcher.generate_optimization_dict(word_to_alt_domain_dict, \
+				max_length=self.max_length, max_representations=self.max_representations))
+			os.replace(path + '_tmp', path)
+			self.substring_to_alt_domain_count_dict = MappedIndex(path)
+			self.version = version
+		elif self.backend == 'suffixarray':
+			from suffixarray import SuffixArrayIndex
+			self.substring_to_alt_domain_count_dict = SuffixArrayIndex(word_to_alt_domain_dict, self.max_length, self.max_representations)
+			l.write(self.output_folder, self.index_name, self.substring_to_alt_domain_count_dict)
+			self.version = version
+		elif self.backend == 'sharded':
+			self.substring_to_alt_domain_count_dict.save()
+		else:
+			l.write(self.output_folder, self.index_name, self.substring_to_alt_domain_count_dict)
+		l.write_version(self.output_folder, self.index_name, self.version)
 
 	# 'slime' -> [['slime'], ['slim', 'lime'], ['sli', 'lim', 'ime'], ['sl', 'li', 'im', 'me']]
 	@staticmethod
@@ -42,18 +165,106 @@ class PatternMatcher:
 		# Note above how substrings of substrings' counts are necessarily more frequent than their superstrings' counterparts,
 		# i.e. "k@p" must occur fewer times than "k@". We can use this fact to subtract superstring counts from substrings counts,
 		# "[Preventing] ... substrings of matches, themselves, from matching" as described in pba.py's populate_precalculated.
+	# Any dict-like backend (i.e. an empty CompactIndex) can be passed in as d to be populated instead.
+	# With processes > 1 the build is split across a process pool (see generate_optimization_dict_parallel.)
+	# max_length and max_representations prune the result (see prune.)
 	@staticmethod
-	def generate_optimization_dict(word_to_alt_domain_dict):
-		substring_to_alt_domain_count_dict = {}
-		for index, word in enumerate(word_to_alt_domain_dict):
-			if index%10000 == 0:
-				print('Indexed {} out of {} words.'.format(index, len(word_to_alt_domain_dict)))
-			alt = word_to_alt_domain_dict[word] # Representation in the alternate domain.
-			substring_to_alt_domain_count_dict = PatternMatcher.add(word, alt, substring_to_alt_domain_count_dict)
-
-		print('Done.')
+	def generate_optimization_dict(word_to_alt_domain_dict, d=None, processes=1, max_length=None, max_representations=None):
+		import time
+		time_before = time.perf_counter()
+		if processes > 1:
+			substring_to_alt_domain_count_dict = PatternMatcher.generate_optimization_dict_parallel(word_to_alt_domain_dict, processes, max_length)
+			if d is not None:
+				for key in substring_to_alt_domain_count_dict:
+					d[key] = substring_to_alt_domain_count_dict[key]
+				substring_to_alt_domain_count_dict = d
+		else:
+			substring_to_alt_domain_count_dict = {} if d is None else d
+			for index, word in enumerate(word_to_alt_domain_dict):
+				if index%10000 == 0:
+					print('Indexed {} out of {} words.'.format(index, len(word_to_alt_domain_dict)))
+				alt = word_to_alt_domain_dict[word] # Representation in the alternate domain.
+				substring_to_alt_domain_count_dict = PatternMatcher.add(word, alt, substring_to_alt_domain_count_dict, max_length=max_length)
+		if max_representations is not None:
+			PatternMatcher.prune(substring_to_alt_domain_count_dict, max_representations)
+		# Backends that stage insertions (i.e. CompactIndex) pack them now.
+		if hasattr(substring_to_alt_domain_count_dict, 'compact'):
+			substring_to_alt_domain_count_dict.compact()
+
+		duration = time.perf_counter() - time_before
+		print('Done. Indexed {} words in {:.2f} seconds ({:.0f} words per second).'.format(len(word_to_alt_domain_dict), \
+			duration, len(word_to_alt_domain_dict)/duration if duration > 0 else 0))
 		return substring_to_alt_domain_count_dict
 
+	# Map: split the lexicon into one contiguous shard per process and count each shard's substrings separately.
+	# Reduce: sum the partial dicts, in shard order.
+	# Merging in shard order means every key (and every representation within a key) is first seen in the same order
+	# as in the serial build, so the result is identical to it -- inner dict order included, which populate_optimized's
+	# match order (and therefore tie-breaking further down the line) depends on.
+	@staticmethod
+	def generate_optimization_dict_parallel(word_to_alt_domain_dict, processes=None, max_length=None):
+		import multiprocessing as mp
+		import math
+		processes = mp.cpu_count() if processes is None else processes
+		items = list(word_to_alt_domain_dict.items())
+		size = math.ceil(len(items)/processes) if len(items) else 1
+		shards = [items[i:i + size] for i in range(0, len(items), size)]
+		print('Indexing {} words in {} shards...'.format(len(items), len(shards)))
+		with mp.Pool(processes=processes) as pool:
+			partials = pool.starmap(PatternMatcher.generate_partial_dict, [(shard, max_length) for shard in shards])
+		print('Merging {} shards...'.format(len(partials)))
+		merged = {}
+		for partial in partials:
+			for key in partial:
+				entry = merged.get(key, None)
+				if entry is None:
+					merged[key] = partial[key]
+					continue
+				for representation, count in partial[key].items():
+					entry[representation] = entry.get(representation, 0) + count
+		return merged
+
+	# One shard's worth of generate_optimization_dict. shard is a list of (word, representation) pairs.
+	@staticmethod
+	def generate_partial_dict(shard, max_length=None):
+		d = {}
+		for word, alt in shard:
+			d = PatternMatcher.add(word, alt, d, max_length=max_length)
+		return d
+
+	# Long substrings and substrings with dozens of rare representations make up most of the optimization dict,
+	# but rarely change populate_optimized's output much. Two ways to leave them out:
+	#	max_length: substrings longer than this are never indexed (see add.)
+	#	max_representations: each substring keeps only its top max_representations representations by count
+	#		(ties and the order of what's kept as they were.)
+	# Either way, decrement's counts become approximate: it needs the counts one letter out on either side
+	# of every match, and some of those are gone (see decrement.) pruning_report in pba.py measures what that costs.
+	# Applies max_representations to every entry of d, in place. Returns d.
+	@staticmethod
+	def prune(d, max_representations):
+		for key in d:
+			entry = d[key]
+			if len(entry) > max_representations:
+				d[key] = PatternMatcher.prune_entry(entry, max_representations)
+		return d
+
+	# The top max_representations representations of entry by count, in their original order.
+	@staticmethod
+	def prune_entry(entry, max_representations):
+		kept = set(sorted(entry, key=lambda representation: -entry[representation])[:max_representations])
+		return {representation: entry[representation] for representation in entry if representation in kept}
+
+	# Converts a flat optimization dict to the given backend.
+	@staticmethod
+	def convert(d, backend):
+		if backend == 'trie':
+			from substringtrie import SubstringTrie
+			return SubstringTrie(d)
+		if backend == 'compact':
+			from compactindex import CompactIndex
+			return CompactIndex(d)
+		return d
+
 	# Use input_letter_substrings_largest_first as keys of substring_to_alt_domain_count_dict[key]
 	# whose values to copy into a new dict, subset_of_optimized_dict.
 
@@ -86,10 +297,11 @@ class PatternMatcher:
 	# and it is utterly ambiguous WHICH parent, [inin] or [ini], should be responsible for decrementation -- bear in mind that in the
 	# current implementation of optimized_dict, there is no way to determine how often "inIN..." ever overlapped with "...INi".
 	# To be able to do so would require far more refactoring than what it'd be worth.
-	def populate_optimized(self, input_word, verbose=False):
+
+	# This is the original, string-keyed implementation of the pass described above. populate_optimized
+	# (below) computes the same matches in closed form; see test_populate_optimized.
+	def populate_optimized_legacy(self, input_word, verbose=False):
 		import re
-		# A shorter way to refer to the optimized dict
-		raw_counts = self.substring_to_alt_domain_count_dict
 		# Any matching key/representation pair with length l >= 3 has two subkeys/sub_representations of length length l - 1. 
 		# During generate_optimization_dict, those subkeys were incremented as a result of matches with this key.
 		# The presence of this key therefore indicates that SOME of the subkeys' counts need to be removed. 
@@ -98,6 +310,8 @@ class PatternMatcher:
 		matches = []
 
 		input_letter_substrings_largest_first = PatternMatcher.generate_substrings_largest_first(input_word)
+		# Every substring of input_word present in the lexical database, mapped by (key, row_index) to its raw counts.
+		found = self.find_substrings(input_word)
 
 		subset_of_optimized_dict = {} # The subset of the optimized dict (substring_to_alt_domain_count) 
 									  # including substrings of input_word.
@@ -122,10 +336,10 @@ class PatternMatcher:
 			# ]
 			for row_index, key in enumerate(row):
 				# Skip substrings of input_word not present in the lexical database.
-				if self.substring_to_alt_domain_count_dict.get(key, None) == None:
+				if found.get((key, row_index), None) == None:
 					continue
 				
-				alt_domain_substring_counts = self.substring_to_alt_domain_count_dict[key].copy()  # i.e. {'sc--s': 6, 's-Wse': 2, 'sc-sx': 1}
+				alt_domain_substring_counts = found[(key, row_index)].copy()  # i.e. {'sc--s': 6, 's-Wse': 2, 'sc-sx': 1}
 				# Map this input substring to an inner dict of every possible representation mapped to its count
 				# By the way, we must also index by row_index because substrings can have separate counts: the two "ar"s in "tartar" will have
 				# separate counts because the first one is rightfully decremented by "art", for instance.
@@ -144,7 +358,7 @@ class PatternMatcher:
 						alt_domain_substring_counts[representation]))
 
 					# Set our raw count.
-					subset_of_optimized_dict[(key, row_index)][representation] = raw_counts[key][representation]
+					subset_of_optimized_dict[(key, row_index)][representation] = found[(key, row_index)][representation]
 					'''
 					DECREMENT OURSELVES
 					'''
@@ -185,8 +399,8 @@ class PatternMatcher:
 						# No previous parent pointed me to their counts.
 						# I therefore must propagate myself downward as the greatest common ancestor to my children.
 
-						left_child_set.add((key, representation, raw_counts[key][representation], row_index))
-						right_child_set.add((key, representation, raw_counts[key][representation], row_index))
+						left_child_set.add((key, representation, found[(key, row_index)][representation], row_index))
+						right_child_set.add((key, representation, found[(key, row_index)][representation], row_index))
 					else:
 						if verbose:
 							print('  {} itself had ancestors: {}'.format(parent_hash, child_hash_to_ancestor_set_and_counts[parent_hash]))
@@ -243,22 +457,301 @@ class PatternMatcher:
 					matches.append(match)
 		return matches
 
+	# The same decrementation as populate_optimized_legacy, without building ancestor sets.
+	#
+	# Call the substring of input_word spanning letters [i, j) with representation r a "match."
+	# Every match's ancestors are the matches that contain it (same letters and representation, plus at least
+	# one more letter on either side.) Each ancestor's decremented count is its raw count minus the decremented counts
+	# of all of ITS ancestors, so for any match m, summing the decremented counts of m and all its ancestors gives back raw(m).
+	#
+	# Every ancestor of m = ([i, j), r) either extends left, and so contains exactly one left parent ([i - 1, j), x + r),
+	# or extends right, and so contains exactly one right parent ([i, j + 1), r + y), or both, and so contains exactly one
+	# grandparent ([i - 1, j + 1), x + r + y). By inclusion-exclusion, then:
+	#
+	#	decremented(m) = raw(m) - sum(raw(left parents)) - sum(raw(right parents)) + sum(raw(grandparents))
+	#
+	# which only ever looks one letter out on either side.
+	# Using "sauce" from above: decremented('sau', 'sc-') = 65 - 0 - (7 + 2) + 0 = 56.
+	#
+	# exclude is an optional (word, alternate domain representation) pair to leave out, as if it had been removed
+	# from the optimization dict first. The optimization dict itself is never touched (see exclude_word.)
+	def populate_optimized(self, input_word, verbose=False, exclude=None):
+		found = self.find_substrings(input_word)
+		if exclude is not None:
+			found = PatternMatcher.exclude_word(found, *exclude)
+		return PatternMatcher.decrement(input_word, found, verbose=verbose, approximate=self.pruned)
+
+	# populate_optimized for a whole batch of words (i.e. a sentence or a document) at once.
+	# Words in a batch share most of their short substrings ("th", "ing", "tion"), so find_substrings_many
+	# looks up each distinct substring once for the whole batch, and each distinct word is decremented once.
+	# excludes is an optional list parallel to input_words of (word, representation) pairs (or None) to leave out.
+	# Returns a list of match lists parallel to input_words.
+	def populate_optimized_many(self, input_words, verbose=False, excludes=None):
+		found_by_word = self.find_substrings_many(input_words)
+		matches_by_word = {}
+		results = []
+		for k, input_word in enumerate(input_words):
+			exclude = excludes[k] if excludes is not None else None
+			if (input_word, exclude) not in matches_by_word:
+				found = found_by_word[input_word]
+				if exclude is not None:
+					found = PatternMatcher.exclude_word(found, *exclude)
+				matches_by_word[(input_word, exclude)] = PatternMatcher.decrement(input_word, found, verbose=verbose, \
+					approximate=self.pruned)
+			results.append(matches_by_word[(input_word, exclude)])
+		return results
+
+	# find_substrings for a batch of words, sharing lookups between them.
+	# Returns a dict of each distinct input word mapped to its output of find_substrings.
+	def find_substrings_many(self, input_words):
+		d = self.substring_to_alt_domain_count_dict
+		# Each distinct substring mapped to its raw counts (or None if it is missing).
+		lookups = {}
+		found_by_word = {}
+		for input_word in input_words:
+			if input_word in found_by_word:
+				continue
+			found = {}
+			for i in range(len(input_word) - 1):
+				for j in range(i + 2, len(input_word) + 1):
+					key = input_word[i:j]
+					if key not in lookups:
+						lookups[key] = d.get(key, None)
+					# Every longer substring starting at i is missing, too.
+					if lookups[key] is None:
+						break
+					found[(key, i)] = lookups[key]
+			found_by_word[input_word] = found
+		return found_by_word
+
+	# Leave-one-out without mutation.
+	# Given found, the output of find_substrings, subtracts every count that adding word (with representation altrep)
+	# contributed, dropping representations (and substrings) left at zero -- exactly what remove would have done
+	# to the optimization dict, but only to the handful of inner dicts input_word actually looks up, and on copies.
+	# This leaves the optimization dict read-only during cross-validation, so it can be shared between threads and processes.
+	@staticmethod
+	def exclude_word(found, word, altrep):
+		# Map each of the excluded word's substrings to its representations' contributions.
+		# Repeated substrings ("ar" in "tartar") contribute once per occurrence, just as add counted them.
+		contributions = {}
+		word_substrings = PatternMatcher.generate_substrings_by_index_and_increasing_length(word)
+		altrep_substrings = PatternMatcher.generate_substrings_by_index_and_increasing_length(altrep)
+		for i, row in enumerate(word_substrings):
+			for j, substring in enumerate(row):
+				entry = contributions.setdefault(substring, {})
+				entry[altrep_substrings[i][j]] = entry.get(altrep_substrings[i][j], 0) + 1
+		remaining = {}
+		for key, index in found:
+			counts = found[(key, index)]
+			excluded = contributions.get(key, None)
+			if excluded is None:
+				remaining[(key, index)] = counts
+				continue
+			counts = {representation: counts[representation] - excluded.get(representation, 0) for representation in counts \
+				if counts[representation] > excluded.get(representation, 0)}
+			if len(counts) != 0:
+				remaining[(key, index)] = counts
+		return remaining
+
+	# For each input length, every span [i, j) of length 2 or more in the order populate_optimized_legacy
+	# visits them (largest first, then left to right), along with its left parent, right parent and grandparent spans
+	# (None when they would fall outside the word.)
+	span_templates = {}
+	@staticmethod
+	def get_span_template(length):
+		template = PatternMatcher.span_templates.get(length, None)
+		if template is not None:
+			return template
+		template = []
+		for size in range(length, 1, -1):
+			for i in range(length - size + 1):
+				j = i + size
+				left = (i - 1, j) if i > 0 else None
+				right = (i, j + 1) if j < length else None
+				both = (i - 1, j + 1) if i > 0 and j < length else None
+				template.append((i, j, left, right, both))
+		PatternMatcher.span_templates[length] = template
+		return template
+
+	# found is the output of find_substrings: {(substring, index within input_word): raw counts}.
+	# Returns a list of tuples of the form (substr, alternate_domain_representation, index, count)
+	# approximate is True when found comes from a pruned optimization dict (see prune),
+	# where negative counts are expected, and dropped without a warning.
+	@staticmethod
+	def decrement(input_word, found, verbose=False, approximate=False):
+		raw = {}
+		for key, index in found:
+			raw[(index, index + len(key))] = found[(key, index)]
+		# Raw counts of each span summed by the representation its right child, left child, or middle child sees:
+		# the representation minus its first letter, minus its last letter, or minus both.
+		# (Only spans of length 3 or more have children.)
+		sums_for_right_child = {}
+		sums_for_left_child = {}
+		sums_for_middle_child = {}
+		for span in raw:
+			if span[1] - span[0] < 3:
+				continue
+			counts = raw[span]
+			right_child, left_child = {}, {}
+			for representation in counts:
+				count = counts[representation]
+				right_child[representation[1:]] = right_child.get(representation[1:], 0) + count
+				left_child[representation[:-1]] = left_child.get(representation[:-1], 0) + count
+			sums_for_right_child[span] = right_child
+			sums_for_left_child[span] = left_child
+			if span[1] - span[0] < 4:
+				continue
+			middle_child = {}
+			for representation in counts:
+				middle_child[representation[1:-1]] = middle_child.get(representation[1:-1], 0) + counts[representation]
+			sums_for_middle_child[span] = middle_child
+
+		matches = []
+		empty = {}
+		for i, j, left, right, both in PatternMatcher.get_span_template(len(input_word)):
+			counts = raw.get((i, j), None)
+			if counts is None:
+				continue
+			key = input_word[i:j]
+			from_left = sums_for_right_child.get(left, empty)
+			from_right = sums_for_left_child.get(right, empty)
+			from_both = sums_for_middle_child.get(both, empty)
+			for representation in counts:
+				count = counts[representation] - from_left.get(representation, 0) \
+					- from_right.get(representation, 0) + from_both.get(representation, 0)
+				if verbose:
+					print((key, representation, i, count))
+				# Substrings of substrings are decremented to zero.
+				if count == 0 or (count < 0 and approximate):
+					continue
+				if count < 0:
+					# Given "substrings of substrings' counts are necessarily more frequent than their superstrings' counterparts",
+					# This should never happen.
+					print('WARNING. Logic was not sound with representation "{}" of count {}.'.format(representation, count))
+				matches.append((key, representation, i, count))
+		return matches
+
+	# decrement for a single span, given its raw counts and those of its left parent, right parent and grandparent
+	# (each None if missing.) Returns a list of tuples of the form (alternate_domain_representation, count),
+	# in the order of counts, leaving out what decrement would.
+	@staticmethod
+	def decrement_span(counts, left, right, both, approximate=False):
+		from_left, from_right, from_both = {}, {}, {}
+		if left is not None:
+			for representation in left:
+				from_left[representation[1:]] = from_left.get(representation[1:], 0) + left[representation]
+		if right is not None:
+			for representation in right:
+				from_right[representation[:-1]] = from_right.get(representation[:-1], 0) + right[representation]
+		if both is not None:
+			for representation in both:
+				from_both[representation[1:-1]] = from_both.get(representation[1:-1], 0) + both[representation]
+		decremented = []
+		for representation in counts:
+			count = counts[representation] - from_left.get(representation, 0) \
+				- from_right.get(representation, 0) + from_both.get(representation, 0)
+			if count == 0 or (count < 0 and approximate):
+				continue
+			if count < 0:
+				print('WARNING. Logic was not sound with representation "{}" of count {}.'.format(representation, count))
+			decremented.append((representation, count))
+		return decremented
+
+	# Returns a dict of the form {(substring, index within input_word): raw counts} for every substring
+	# of input_word (of length 2 or more) present in the optimization dict.
+	def find_substrings(self, input_word):
+		if self.backend != 'dict':
+			return self.substring_to_alt_domain_count_dict.find_substrings(input_word)
+		found = {}
+		for row in PatternMatcher.generate_substrings_largest_first(input_word):
+			for row_index, key in enumerate(row):
+				entry = self.substring_to_alt_domain_count_dict.get(key, None)
+				if entry is not None:
+					found[(key, row_index)] = entry
+		return found
+
+	# A fingerprint of the optimization dict: the sum of hash((substring, representation, count)) over every
+	# representation of every substring, mod 2**64. It doesn't depend on order, so once computed, replace and remove
+	# keep it up to date by swapping out the terms of just the counts they change (see update_fingerprint.)
+	# Comparing fingerprints stands in for comparing (and copying) the whole dict, i.e. in simulate_leaveoneout.
+	# Python salts str hashes per process, so only compare fingerprints taken in the same process.
+	@staticmethod
+	def compute_fingerprint(d):
+		fingerprint = 0
+		for key in d:
+			entry = d[key]
+			for representation in entry:
+				fingerprint += hash((key, representation, entry[representation]))
+		return fingerprint & FINGERPRINT_MASK
+
+	def get_fingerprint(self):
+		if self.fingerprint is None:
+			self.fingerprint = PatternMatcher.compute_fingerprint(self.substring_to_alt_domain_count_dict)
+		return self.fingerprint
+
+	# Called before adding (sign 1) or removing (sign -1) input_word, while the counts it's about to change are still there.
+	def update_fingerprint(self, input_word, input_altrep, sign):
+		if self.fingerprint is None:
+			return
+		# Repeated substrings ("ar" in "tartar") change their count once per occurrence.
+		contributions = {}
+		word_substrings = PatternMatcher.generate_substrings_by_index_and_increasing_length(input_word)
+		altrep_substrings = PatternMatcher.generate_substrings_by_index_and_increasing_length(input_altrep)
+		for i, row in enumerate(word_substrings):
+			for j, substring in enumerate(row):
+				if self.max_length is not None and len(substring) > self.max_length:
+					break
+				pair = (substring, altrep_substrings[i][j])
+				contributions[pair] = contributions.get(pair, 0) + 1
+		d = self.substring_to_alt_domain_count_dict
+		fingerprint = self.fingerprint
+		for (substring, representation), contribution in contributions.items():
+			count = d.get(substring, {}).get(representation, 0)
+			if sign < 0 and count == 0:
+				# remove leaves missing representations alone.
+				continue
+			if count != 0:
+				fingerprint -= hash((substring, representation, count))
+			count = max(count + sign*contribution, 0)
+			if count != 0:
+				fingerprint += hash((substring, representation, count))
+		self.fingerprint = fingerprint & FINGERPRINT_MASK
+
 	# A nice and encapsulated way to put a word back after cross-validation.
 	def replace(self, input_word, input_altrep):
+		if self.backend in READ_ONLY_BACKENDS:
+			print('Warning. The {} backend is read-only. Could not add {}.'.format(self.backend, input_word))
+			return
+		if self.max_representations is not None:
+			# Pruning may drop any count in the entries this word grows. Recompute on next use.
+			self.fingerprint = None
+		self.update_fingerprint(input_word, input_altrep, 1)
 		self.substring_to_alt_domain_count_dict = \
-			PatternMatcher.add(input_word, input_altrep, self.substring_to_alt_domain_count_dict)
+			PatternMatcher.add(input_word, input_altrep, self.substring_to_alt_domain_count_dict, max_length=self.max_length)
+		if self.max_representations is not None:
+			# Prune whatever entries this word grew.
+			d = self.substring_to_alt_domain_count_dict
+			for row in PatternMatcher.generate_substrings_by_index_and_increasing_length(input_word):
+				for substring in row:
+					entry = d.get(substring, None)
+					if entry is not None and len(entry) > self.max_representations:
+						d[substring] = PatternMatcher.prune_entry(entry, self.max_representations)
 
 
 	# Populate dict d with word input_word and its alternate representation input_altrep.
 	# This method is also used to put a word back after leave-one-out cross-validation.
+	# Substrings longer than max_length (if given) are skipped.
 	@staticmethod
-	def add(input_word, input_altrep, d, verbose=False):
+	def add(input_word, input_altrep, d, verbose=False, max_length=None):
 		# d is substring_to_alt_domain_count_dict, 
 		substrings = PatternMatcher.generate_substrings_by_index_and_increasing_length(input_word)
 		substrings_alt = PatternMatcher.generate_substrings_by_index_and_increasing_length(input_altrep)
 		for i, row in enumerate(substrings):
 			# Populate dict iterating by this word's mappings.
 			for j, substring in enumerate(row):
+				# Rows are in increasing length.
+				if max_length is not None and len(substring) > max_length:
+					break
 				substr_alt = substrings_alt[i][j]
 				# Get or instantiate this substring's counts.
 				entry = d.get(substring, {})
@@ -279,6 +772,10 @@ class PatternMatcher:
 	def remove(self, input_word, input_altrep, verbose=False):
 		if verbose:
 			print('Attempting to remove {} ({}) from the optimized dataset'.format(input_word, input_altrep))
+		if self.backend in READ_ONLY_BACKENDS:
+			print('Warning. The {} backend is read-only. Leave {} out with populate_optimized(..., exclude=...) instead.'.format(self.backend, input_word))
+			return False
+		self.update_fingerprint(input_word, input_altrep, -1)
 		# Helper function.
 		def decrement_or_delete(sub_input, sub_altrep):
 			nonlocal input_word
@@ -293,7 +790,10 @@ class PatternMatcher:
 
 			# Okay, now we know we exist. remove ourselves from that entry.
 			count = entry.get(sub_altrep, -1)
-			if count <= -1:
+			if count <= -1 and self.max_representations is not None:
+				# Pruned (see prune.)
+				pass
+			elif count <= -1:
 				print('Warning. The input word exists in optimized dict, but NOT with the provided ground truth alternate domain representation.')
 			elif count == 0:
 				print('Warning. The input word\'s provided alternate domain representation was at count zero. This should never happen.')
@@ -305,19 +805,89 @@ class PatternMatcher:
 					if verbose:
 						print('That was the only representation. Removing {} from main dict as well.'.format(sub_input))
 					del self.substring_to_alt_domain_count_dict[sub_input]
+				else:
+					# Store it again, since not every backend hands out its inner dicts live.
+					self.substring_to_alt_domain_count_dict[sub_input] = entry
 			else:
 				# We only decrement.
 				if verbose:
 					print('Successfully decremented {} from {}.'.format(sub_altrep, sub_input))
 				entry[sub_altrep] -= 1
+				self.substring_to_alt_domain_count_dict[sub_input] = entry
 		# Main loop of the method.
 		input_word_substrings = PatternMatcher.generate_substrings_largest_first(input_word)
 		input_altrep_substrings = PatternMatcher.generate_substrings_largest_first(input_altrep)
 		for i, row in enumerate(input_word_substrings):
 			for j in range(len(row)):
+				# Never indexed (see prune.)
+				if self.max_length is not None and len(row[j]) > self.max_length:
+					continue
 				decrement_or_delete(input_word_substrings[i][j], input_altrep_substrings[i][j]) 
 		return True
 
+	# remove for a whole batch of (word, representation) pairs at once, i.e. a cross-validation fold.
+	# Their contributions are summed into one Counter of (substring, representation) decrements first,
+	# so each substring's entry is read and written back once, however many of the words share it.
+	# Returns what's needed to put them back with restore: a copy of every entry it changed, as it was.
+	def remove_many(self, pairs):
+		from collections import Counter
+		if self.backend in READ_ONLY_BACKENDS:
+			print('Warning. The {} backend is read-only. Leave words out with populate_optimized(..., exclude=...) instead.'.format(self.backend))
+			return None
+		decrements = Counter()
+		for word, altrep in pairs:
+			word_substrings = PatternMatcher.generate_substrings_by_index_and_increasing_length(word)
+			altrep_substrings = PatternMatcher.generate_substrings_by_index_and_increasing_length(altrep)
+			for i, row in enumerate(word_substrings):
+				for j, substring in enumerate(row):
+					if self.max_length is not None and len(substring) > self.max_length:
+						break
+					decrements[(substring, altrep_substrings[i][j])] += 1
+		by_substring = {}
+		for (substring, representation), decrement in decrements.items():
+			by_substring.setdefault(substring, {})[representation] = decrement
+		d = self.substring_to_alt_domain_count_dict
+		saved = {}
+		fingerprint_before = self.fingerprint
+		fingerprint = self.fingerprint
+		for substring, entry_decrements in by_substring.items():
+			entry = d.get(substring, None)
+			if entry is None:
+				continue
+			# Change a copy. The original goes back as is.
+			saved[substring] = entry
+			entry = dict(entry)
+			for representation, decrement in entry_decrements.items():
+				count = entry.get(representation, 0)
+				# Missing representations were pruned (see prune.)
+				if count == 0:
+					continue
+				if fingerprint is not None:
+					fingerprint -= hash((substring, representation, count))
+				if count > decrement:
+					entry[representation] = count - decrement
+					if fingerprint is not None:
+						fingerprint += hash((substring, representation, count - decrement))
+				else:
+					del entry[representation]
+			if len(entry) == 0:
+				del d[substring]
+			else:
+				d[substring] = entry
+		if fingerprint is not None:
+			self.fingerprint = fingerprint & FINGERPRINT_MASK
+		return (saved, fingerprint_before)
+
+	# Puts back what remove_many took out, exactly as it was (inner dict order included.)
+	def restore(self, removed):
+		if removed is None:
+			return
+		saved, fingerprint = removed
+		d = self.substring_to_alt_domain_count_dict
+		for substring, entry in saved.items():
+			d[substring] = entry
+		self.fingerprint = fingerprint
+
 	@staticmethod
 	def copy_dict(a):
 		copy = {}
@@ -341,79 +911,78 @@ class PatternMatcher:
 
 	# Removing a word and adding it back should not permanently change the contents of either dict.
 	# Cross validation should leave no trace! or else the dict will deteriorate over the course of the test.
-	# When check_every = -1, we check every single iteration. This is very, very slow.
+	# Rather than copying and comparing the whole dict, this compares fingerprints (see compute_fingerprint),
+	# which replace and remove keep up to date, so every word can be checked.
+	# When check_every = -1, we check every single iteration.
 	# Otherwise, check_every must be 2 or more due to modulo.
-	def simulate_leaveoneout(self, ground_truth_dict, check_every=-1):
+	def simulate_leaveoneout(self, ground_truth_dict, check_every=-1, print_every=10000):
 		if check_every != -1 and check_every <2:
 			print('NO. check_every must equal -1 OR be above 1.')
 			exit()
 		words_tested = 0
-		is_test_round = False # Checking for dict equality is hugely expensive.
-		# Let's only test every once in a while.
-		has_failed = False # Also, only copy dicts again after you've failed.
-
 		total_tests = 0
 		total_failures = 0
 
-		# Let's just refer to them this way, it's easier to type.
-		d_ = self.substring_to_alt_domain_count_dict
-		# Copy at the beginning.
-		d_pre = PatternMatcher.copy_dict(d_)
+		fingerprint_pre = self.get_fingerprint()
 
 		for word in ground_truth_dict:
 			# Print updates periodically.
-			# We test every representation of every word.
-			representation = ground_truth_dict[word]
-			
-			if check_every == -1 or ((words_tested)%check_every == 0):
+			if words_tested%print_every == 0:
 				print('{} / {} ({:.2f}%) words have been tested.'.format( \
 					words_tested, len(ground_truth_dict), \
 					100*words_tested/len(ground_truth_dict)))
 				print('TEST COUNT: {} FAILURE COUNT: {}'.format(total_tests, total_failures))
-				is_test_round = True # Reset this.
-				# Flush copy.
-				if has_failed:
-					d_pre = PatternMatcher.copy_dict(d_)
-				has_failed = False
+			# We test every representation of every word.
+			representation = ground_truth_dict[word]
+			is_test_round = check_every == -1 or words_tested%check_every == 0
 
 			# Remove the word.
 			self.remove(word, representation)
 			# TEST ROUND BARRIER 1
 			if is_test_round:
 				# Make sure the dicts are NOT equal.
-				if d_ == d_pre:
+				if self.fingerprint == fingerprint_pre:
 					print('WARNING. The removal of {} ({}) did not change the optimized dict.'.format(word, representation))
 					total_failures += 1
-					has_failed = True
 			# Add the word back.
 			self.replace(word, representation)
 
 			# TEST ROUND BARRIER 2
 			if is_test_round:
-
 				# Make sure the dicts ARE equal.
-				if d_ != d_pre:
+				if self.get_fingerprint() != fingerprint_pre:
 					print('WARNING. Removal and replacement of {} ({}) has permanently altered the optimized dict.'.format(word, representation))
 					total_failures += 1
-					has_failed = True
+					# Carry on from here, so one failure isn't reported for every word after it.
+					fingerprint_pre = self.fingerprint
 				# "total_failures" has had the opportunity to increment two times.
 				total_tests += 2
-				is_test_round = False
 			words_tested += 1
+		# The incrementally kept fingerprint should match one computed from scratch.
+		if self.max_representations is None and self.fingerprint != PatternMatcher.compute_fingerprint(self.substring_to_alt_domain_count_dict):
+			print('WARNING. The fingerprint has drifted from the optimized dict\'s contents.')
+			total_failures += 1
 		print('Test complete. Out of {} opportunities to fail, {} tests actually failed.'.format(total_tests, total_failures))
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+	# populate_optimized and populate_optimized_legacy should produce the same match list (same tuples, same order)
+	# for every word in the lexicon, and for random strings built from the lexicon's letters, which exercise
+	# partial and missing matches. Reports every word on which they disagree.
+	def test_populate_optimized(self, words, random_count=10000, seed=0, print_every=10000):
+		import random
+		rng = random.Random(seed)
+		words = list(words)
+		# Keep padding consistent with the lexicon's.
+		padded = len(words) > 0 and words[0].startswith('#')
+		letters = sorted(set(''.join(words)) - set('#'))
+		for _ in range(random_count):
+			word = ''.join(rng.choice(letters) for _ in range(rng.randint(2, 20)))
+			words.append('#{}#'.format(word) if padded else word)
+		failures = []
+		for i, word in enumerate(words):
+			if i%print_every == 0:
+				print('{} / {} words tested. {} failures.'.format(i, len(words), len(failures)))
+			if self.populate_optimized(word) != self.populate_optimized_legacy(word):
+				print('WARNING. populate_optimized and populate_optimized_legacy disagree on {}.'.format(word))
+				failures.append(word)
+		print('Test complete. {} out of {} words disagreed.'.format(len(failures), len(words)))
+		return failures
@@ -3,13 +3,20 @@
 # as summarized by Marchand & Damper's "Can syllabification improve
 # pronunciation by analogy of English?
 from lattice import Lattice, ERRORS
-from patternmatcher import PatternMatcher
+from compactlattice import CompactLattice
+from patternmatcher import PatternMatcher, READ_ONLY_BACKENDS
 from oldpatternmatcher import OldPatternMatcher
+from deltalog import DeltaLog
+import os
 
 USE_EXPERIMENTAL_PATTERNMATCHER = True
 # Takes longer, but potentially yields better results by linking certain phonemes to word borders.
 # Attempting to pronounce "the" without padding yields "D-R", but with padding yields (correctly) "D-x".
 MULTIPROCESS_LEGACY = False
+# Build CompactLattices rather than Lattices when pattern matching with PatternMatcher. Same results, far fewer objects.
+USE_COMPACT_LATTICE = False
+# If set, pronounce appends every lattice it populates to this file, to replay search and ranking on later (see replay.py.)
+LATTICE_SNAPSHOTS = None
 
 class PronouncerByAnalogy:
 	@staticmethod
@@ -21,7 +28,8 @@ class PronouncerByAnalogy:
 			s = '#{}#'.format(s)
 		return s
 
-	def cross_validate(self, start=0, pad=True):
+	# Trial words are pattern matched batch_size at a time (see PatternMatcher.populate_optimized_many.)
+	def cross_validate(self, start=0, pad=True, batch_size=256):
 		from datetime import datetime
 		from collections.abc import Iterable
 		now = datetime.today().strftime('%Y-%m-%d-%H-%M-%S')
@@ -38,20 +46,13 @@ class PronouncerByAnalogy:
 		words_total = {}
 		phonemes_correct = {}
 		phonemes_total = {}
+		# Matches for upcoming trial words, each with itself left out.
+		prefetched = {}
 		with open('Data/Results_{}.txt'.format(now), 'w', encoding='latin-1') as f:
 			def end_trial(output):
 				nonlocal trial
 				f.write(output)
 				trial += 1
-			# Iterate the occurrences of this error. Return the line to append to the file.
-			def count_error(code):
-				description = ERRORS[code]
-				PronouncerByAnalogy.simple_print(code)
-				# Log instance of error code.
-				words_total[description] = words_total.get(description, 0) + 1
-				# Print results.
-				return '{}, {}\n\n'.format(description, words_total.get(description, 0))
-
 			while trial < trial_count:
 				output = ''
 				i = 0
@@ -67,36 +68,23 @@ class PronouncerByAnalogy:
 					continue
 				print('Loading trial #{}: {} ({})...'.format(trial, trial_word, ground_truth))
 
-				results = self.cross_validate_pronounce(trial_word, pad=pad)
+				matches = None
+				if USE_EXPERIMENTAL_PATTERNMATCHER:
+					if trial_word not in prefetched:
+						batch = [word for word in wordlist[trial:trial + batch_size] if word in ldb]
+						pm = self.pm_pad if pad else self.pm
+						prefetched = dict(zip(batch, pm.populate_optimized_many(batch, excludes=[(word, ldb[word]) for word in batch])))
+					matches = prefetched[trial_word]
+
+				results = self.cross_validate_pronounce(trial_word, pad=pad, matches=matches)
 				if not isinstance(results, Iterable):
 					# Print the error.
 					error_code = results
-					output += count_error(error_code)
+					output += PronouncerByAnalogy.count_error(error_code, words_total)
 					end_trial(output)
 					continue
 
-				for key in results:
-					method = key
-					phoneme_correct = 0
-					total_phonemes = 0
-					# Iterate words for which this trial had a result.
-					words_total[key] = words_total.get(key, 0) + 1
-					# Evaluate that result.
-					if results[key].pronunciation == ground_truth:
-						words_correct[key] = words_correct.get(key, 0) + 1
-					# Iterate phonemes for which this trial had a result.
-					for index, ch in enumerate(results[key].pronunciation):
-						# Total always iterates.
-						phonemes_total[key] = phonemes_total.get(key, 0) + 1
-						if index < len(ground_truth) and ch == ground_truth[index]:
-							# Correct only when correct.
-							phonemes_correct[key] = phonemes_correct.get(key, 0) + 1
-				for key in results:
-					output += '{}, {}, {}, {}, {}\n'.format(key, words_correct.get(key, 0), words_total.get(key, 0), \
-						phonemes_correct.get(key, 0), phonemes_total.get(key, 0))
-					print('{}: {}, {}. {}/{} words correct ({:.2f}%), {}/{} phonemes correct ({:.2f}%)'.format(key, results[key].pronunciation, results[key].pronunciation == ground_truth, words_correct.get(key, 0), words_total.get(key, 0), \
-						100*words_correct.get(key, 0)/words_total.get(key, 1), phonemes_correct.get(key, 0), phonemes_total.get(key, 0), 100*phonemes_correct.get(key, 0)/phonemes_total.get(key, 0)))
-				output += '\n'
+				output += PronouncerByAnalogy.tally(results, ground_truth, words_correct, words_total, phonemes_correct, phonemes_total)
 				end_trial(output)
 				# Total only increments after a nonskipped trial.
 				total += 1
@@ -106,13 +94,115 @@ class PronouncerByAnalogy:
 				#print('{} vs. {}'.format(ground_truth, best[0]))
 				print()
 
+	# Iterates the occurrences of a trial's error code in words_total. Returns the line to append to the results file.
+	# decide returns None rather than an error code when it has no candidates, so None (or any code not in ERRORS)
+	# is counted as NO_RESULT.
+	@staticmethod
+	def count_error(code, words_total):
+		if code in ERRORS:
+			description = ERRORS[code]
+			PronouncerByAnalogy.simple_print(code)
+		else:
+			description = 'NO_RESULT'
+			print('No result ({}).'.format(code))
+		# Log instance of error code.
+		words_total[description] = words_total.get(description, 0) + 1
+		return '{}, {}\n\n'.format(description, words_total.get(description, 0))
+
+	# Adds one trial's results to the running statistics (each a dict of strategy mapped to a count.)
+	# Returns the lines to append to the results file.
+	@staticmethod
+	def tally(results, ground_truth, words_correct, words_total, phonemes_correct, phonemes_total):
+		output = ''
+		for key in results:
+			# Iterate words for which this trial had a result.
+			words_total[key] = words_total.get(key, 0) + 1
+			# Evaluate that result.
+			if results[key].pronunciation == ground_truth:
+				words_correct[key] = words_correct.get(key, 0) + 1
+			# Iterate phonemes for which this trial had a result.
+			for index, ch in enumerate(results[key].pronunciation):
+				# Total always iterates.
+				phonemes_total[key] = phonemes_total.get(key, 0) + 1
+				if index < len(ground_truth) and ch == ground_truth[index]:
+					# Correct only when correct.
+					phonemes_correct[key] = phonemes_correct.get(key, 0) + 1
+		for key in results:
+			output += '{}, {}, {}, {}, {}\n'.format(key, words_correct.get(key, 0), words_total.get(key, 0), \
+				phonemes_correct.get(key, 0), phonemes_total.get(key, 0))
+			print('{}: {}, {}. {}/{} words correct ({:.2f}%), {}/{} phonemes correct ({:.2f}%)'.format(key, results[key].pronunciation, results[key].pronunciation == ground_truth, words_correct.get(key, 0), words_total.get(key, 0), \
+				100*words_correct.get(key, 0)/words_total.get(key, 1), phonemes_correct.get(key, 0), phonemes_total.get(key, 0), 100*phonemes_correct.get(key, 0)/phonemes_total.get(key, 0)))
+		output += '\n'
+		return output
+
+	# k-fold cross-validation. Much faster than cross_validate's leave-one-out: the lexicon is shuffled (by seed)
+	# into k folds, and each fold is taken out of the pattern matcher all at once (see PatternMatcher.remove_many),
+	# its words pronounced against the rest, then put back all at once. Writes the same statistics as cross_validate.
+	def cross_validate_kfold(self, k=10, pad=True, seed=0):
+		import random
+		from datetime import datetime
+		from collections.abc import Iterable
+		now = datetime.today().strftime('%Y-%m-%d-%H-%M-%S')
+		ldb = self.lexical_database_pad if pad else self.lexical_database
+		wordlist = list(ldb.keys())
+		random.Random(seed).shuffle(wordlist)
+		folds = [wordlist[i::k] for i in range(k)]
+		pm = None
+		if USE_EXPERIMENTAL_PATTERNMATCHER:
+			pm = self.pm_pad if pad else self.pm
+			if pm.backend in READ_ONLY_BACKENDS:
+				print('The {} backend is read-only. Use cross_validate instead.'.format(pm.backend))
+				return
+		# Map the strategy name to the titular stat.
+		words_correct = {}
+		words_total = {}
+		phonemes_correct = {}
+		phonemes_total = {}
+		trial = 0
+		with open('Data/Results_{}.txt'.format(now), 'w', encoding='latin-1') as f:
+			for fold_index, fold in enumerate(folds):
+				print('Fold {} of {}: holding out {} words...'.format(fold_index + 1, k, len(fold)))
+				held_out = set(fold)
+				trimmed_lexical_database = {word: ldb[word] for word in ldb if word not in held_out}
+				trimmed_substring_database = None
+				saved = None
+				if pm is not None:
+					saved = pm.remove_many([(word, ldb[word]) for word in fold])
+				else:
+					sdb = self.substring_database_pad if pad else self.substring_database
+					trimmed_substring_database = {word: sdb[word] for word in trimmed_lexical_database}
+				matches_list = pm.populate_optimized_many(fold) if pm is not None else [None]*len(fold)
+				for trial_word, matches in zip(fold, matches_list):
+					output = 'TRIAL {}, {}\n'.format(trial, trial_word)
+					ground_truth = ldb[trial_word]
+					print('Loading trial #{}: {} ({})...'.format(trial, trial_word, ground_truth))
+					results = PronouncerByAnalogy.pronounce(trial_word, trimmed_lexical_database, trimmed_substring_database, pm, matches=matches)
+					if not isinstance(results, Iterable):
+						# Print the error.
+						output += PronouncerByAnalogy.count_error(results, words_total)
+					else:
+						output += PronouncerByAnalogy.tally(results, ground_truth, words_correct, words_total, phonemes_correct, phonemes_total)
+					f.write(output)
+					trial += 1
+					print()
+				if pm is not None:
+					pm.restore(saved)
+
 	# skip_every is -1 (disabled) or >= 2. Generates smaller datasets for easier testing.
-	def __init__(self, output_folder, dataset_filename, skip_every=-1, offset=0, verbose=False):
+	# backend is how PatternMatcher stores its optimization dict (see patternmatcher.BACKENDS).
+	# build_processes > 1 builds missing optimization dicts with a process pool.
+	# Words added or removed with add_word/remove_word are folded back into the saved databases every compact_every changes.
+	# max_length and max_representations prune the pattern matchers' optimization dicts (see PatternMatcher.prune and pruning_report.)
+	def __init__(self, output_folder, dataset_filename, skip_every=-1, offset=0, verbose=False, backend='dict', build_processes=1, compact_every=1000, \
+		max_length=None, max_representations=None):
 		import loader as l
 
+		self.output_folder = output_folder
+		self.backend = backend
 		self.dataset_filename = dataset_filename
 		self.skip_every = skip_every
 		self.offset = offset
+		self.compact_every = compact_every
 
 		self.pl = None
 		print('Loading lexical database...')
@@ -122,7 +212,9 @@ class PronouncerByAnalogy:
 		def format_name(prefix, f, use_padding):
 			nonlocal skip_every
 			nonlocal offset
-			formatted_name = '{}_{}_padding-{}'.format(prefix, f, use_padding)
+			formatted_name = '{}_{}'.format(prefix, f)
+			# Append padding if applicable.
+			formatted_name = formatted_name + '_padding-' + str(use_padding) if use_padding is not None else formatted_name
 			# Append the skip factor if applicable.
 			formatted_name = formatted_name + '_skipping-every-' + str(skip_every) if skip_every != -1 else formatted_name
 			# Append offset if applicable.
@@ -133,18 +225,18 @@ class PronouncerByAnalogy:
 		ldp_name = format_name("ld", dataset_filename, True)
 		sd_name = format_name("sd", dataset_filename, False)
 		sdp_name = format_name("sd", dataset_filename, True)
+		self.lexicon_names = [ld_name, ldp_name, sd_name, sdp_name]
 
 		self.lexical_database = l.load(output_folder, ld_name)
 		self.lexical_database_pad = l.load(output_folder, ldp_name)
-		self.substring_database = l.load(output_folder, sd_name)
-		self.substring_database_pad = l.load(output_folder, sdp_name)
+		# The substring databases are loaded on first use (see load_substring_databases.)
+		self.substring_databases = None
 
 		if self.lexical_database is None or self.lexical_database_pad is None \
-		or self.substring_database is None or self.substring_database_pad is None:
+		or not os.path.exists(output_folder + sd_name) or not os.path.exists(output_folder + sdp_name):
 			self.lexical_database = {}
-			self.substring_database = {}
 			self.lexical_database_pad = {}
-			self.substring_database_pad = {}
+			self.substring_databases = [{}, {}]
 			print('Loading lexical databases from text...')
 			# Load the input data.
 			with open('Preprocessing/Out/{}.txt'.format(dataset_filename), 'r', encoding='latin-1') as f:
@@ -171,15 +263,134 @@ class PronouncerByAnalogy:
 			l.write(output_folder, ldp_name, self.lexical_database_pad)
 			l.write(output_folder, sd_name, self.substring_database)
 			l.write(output_folder, sdp_name, self.substring_database_pad)
+			l.write_version(output_folder, ld_name, 0)
+			l.write_version(output_folder, sd_name, 0)
+
+		# Catch up on words added or removed since the databases were saved.
+		# Both lexical databases share the version saved alongside the nonpadded one. Likewise the substring databases.
+		self.delta_log = DeltaLog('{}{}'.format(output_folder, format_name("delta", dataset_filename, None)))
+		self.lexicon_version = l.load_version(output_folder, ld_name)
+		for entry in self.delta_log.entries_after(self.lexicon_version):
+			self.apply_to_lexicon(*entry)
 
 		pm_name = format_name("optimized", dataset_filename, False)
 		pmp_name = format_name("optimized", dataset_filename, True)
-		self.pm = PatternMatcher(self.lexical_database, output_folder, pm_name, False, skip_every, offset)
-		self.pm_pad = PatternMatcher(self.lexical_database_pad, output_folder, pmp_name, True, skip_every, offset)
+		self.pattern_matcher_names = [pm_name, pmp_name]
+		self.pm = PatternMatcher(self.lexical_database, output_folder, pm_name, False, skip_every, offset, backend=backend, build_processes=build_processes, \
+			lexicon_version=self.lexicon_version, max_length=max_length, max_representations=max_representations)
+		self.pm_pad = PatternMatcher(self.lexical_database_pad, output_folder, pmp_name, True, skip_every, offset, backend=backend, build_processes=build_processes, \
+			lexicon_version=self.lexicon_version, max_length=max_length, max_representations=max_representations)
+		for pm in (self.pm, self.pm_pad):
+			self.catch_up(pm)
+
+	# Applies whichever delta log entries pattern matcher pm is missing.
+	def catch_up(self, pm):
+		pending = self.delta_log.entries_after(pm.version)
+		for entry in pending:
+			self.apply_to_pattern_matcher(pm, *entry)
+		if pm.version != self.lexicon_version:
+			print('Warning. {} is missing {} added or removed words. Call compact_deltas() to rebuild it.'.format(pm.index_name, len(pending)))
+
+	# The substring databases are only used by OldPatternMatcher (and to trim the dataset in cross_validate_pronounce),
+	# yet take longer to unpickle than everything else put together. So they're loaded the first time they're needed,
+	# catching up on the delta log from the version saved alongside them.
+	@property
+	def substring_database(self):
+		return self.load_substring_databases()[0]
+
+	@property
+	def substring_database_pad(self):
+		return self.load_substring_databases()[1]
+
+	def load_substring_databases(self):
+		import loader as l
+		if self.substring_databases is None:
+			sd_name, sdp_name = self.lexicon_names[2:]
+			self.substring_databases = [l.load(self.output_folder, sd_name), l.load(self.output_folder, sdp_name)]
+			# Saved before the substring databases had their own version, i.e. alongside the lexical databases'.
+			version_name = sd_name if os.path.exists('{}{}_version'.format(self.output_folder, sd_name)) else self.lexicon_names[0]
+			for entry in self.delta_log.entries_after(l.load_version(self.output_folder, version_name)):
+				self.apply_to_substring_databases(*entry)
+		return self.substring_databases
+
+	# Applies one delta log entry (see deltalog.py) to the lexical databases,
+	# and to the substring databases if they're loaded (otherwise they catch up once they are.)
+	def apply_to_lexicon(self, version, op, word, phonemes):
+		for lex, a, b in ((self.lexical_database, word, phonemes), (self.lexical_database_pad, '#{}#'.format(word), '${}$'.format(phonemes))):
+			if op == '+':
+				lex[a] = b
+			else:
+				lex.pop(a, None)
+		if self.substring_databases is not None:
+			self.apply_to_substring_databases(version, op, word, phonemes)
+		self.lexicon_version = version
+
+	def apply_to_substring_databases(self, version, op, word, phonemes):
+		for sub, a in zip(self.substring_databases, (word, '#{}#'.format(word))):
+			if op == '+':
+				sub[a] = PatternMatcher.generate_substrings_by_index_and_increasing_length(a)
+			else:
+				sub.pop(a, None)
+
+	# Applies one delta log entry to pattern matcher pm.
+	def apply_to_pattern_matcher(self, pm, version, op, word, phonemes):
+		if pm.use_padding:
+			word = '#{}#'.format(word)
+			phonemes = '${}$'.format(phonemes)
+		pm.apply_delta(version, op, word, phonemes)
+
+	def apply_delta(self, op, word, phonemes):
+		entry = (self.delta_log.append(op, word, phonemes), op, word, phonemes)
+		self.apply_to_lexicon(*entry)
+		for pm in (self.pm, self.pm_pad):
+			self.apply_to_pattern_matcher(pm, *entry)
+
+	# Adds word (without padding) to the dataset, pronounced phonemes, replacing any previous pronunciation.
+	# The change is logged, so it survives a restart without rebuilding anything.
+	def add_word(self, word, phonemes):
+		# Like the preprocessed dataset, phonemes must be aligned one-to-one with letters.
+		if len(phonemes) != len(word):
+			print('Warning. {} ({}) is not aligned. Could not add it.'.format(word, phonemes))
+			return
+		previous = self.lexical_database.get(word, None)
+		if previous == phonemes:
+			return
+		if previous is not None:
+			self.apply_delta('-', word, previous)
+		self.apply_delta('+', word, phonemes)
+		if self.delta_log.pending_count() >= self.compact_every:
+			self.compact_deltas()
+
+	# Removes word (without padding) from the dataset. Returns false if it wasn't there.
+	def remove_word(self, word):
+		previous = self.lexical_database.get(word, None)
+		if previous is None:
+			return False
+		self.apply_delta('-', word, previous)
+		if self.delta_log.pending_count() >= self.compact_every:
+			self.compact_deltas()
+		return True
+
+	# Saves every database with the delta log folded in, then empties the log.
+	def compact_deltas(self):
+		import loader as l
+		print('Compacting {} added or removed words...'.format(self.delta_log.pending_count()))
+		l.write(self.output_folder, self.lexicon_names[0], self.lexical_database)
+		l.write(self.output_folder, self.lexicon_names[1], self.lexical_database_pad)
+		l.write_version(self.output_folder, self.lexicon_names[0], self.lexicon_version)
+		# Substring databases that were never loaded never changed. They catch up from the archive once they are.
+		if self.substring_databases is not None:
+			l.write(self.output_folder, self.lexicon_names[2], self.substring_database)
+			l.write(self.output_folder, self.lexicon_names[3], self.substring_database_pad)
+			l.write_version(self.output_folder, self.lexicon_names[2], self.lexicon_version)
+		self.pm.save(self.lexical_database, self.lexicon_version)
+		self.pm_pad.save(self.lexical_database_pad, self.lexicon_version)
+		self.delta_log.compact()
 
 
 	# Removes input word from the dataset before pronouncing if present.
-	def cross_validate_pronounce(self, input_word, verbose=False, pad=True):
+	# matches are optional, precomputed (with input word left out) by populate_optimized_many.
+	def cross_validate_pronounce(self, input_word, verbose=False, pad=True, matches=None):
 		input_word = PronouncerByAnalogy.pad_if(input_word, pad)
 		ldb = self.lexical_database_pad if pad else self.lexical_database
 		sdb = self.substring_database_pad if pad else self.substring_database
@@ -201,24 +412,125 @@ class PronouncerByAnalogy:
 			print('The dataset did not have {}.'.format(input_word))
 
 		pm = None
+		exclude = None
 		if USE_EXPERIMENTAL_PATTERNMATCHER:
 			pm = self.pm_pad if pad else self.pm
-			# Can't remove a word unless we have its representation.
+			# Can't leave a word out unless we have its representation.
+			# Rather than pm.remove(...) followed by pm.replace(...), which mutates the shared optimization dict
+			# on every trial, ask the pattern matcher to subtract the word's contributions at query time.
 			if answer != '':
-				pm.remove(input_word, answer)
+				exclude = (input_word, answer)
 
-		results = PronouncerByAnalogy.pronounce(input_word, trimmed_lexical_database, trimmed_substring_database, verbose=False, pm=pm)
+		results = PronouncerByAnalogy.pronounce(input_word, trimmed_lexical_database, trimmed_substring_database, verbose=False, pm=pm, exclude=exclude, matches=matches)
 		if verbose:
 			PronouncerByAnalogy.simple_print(results, answer)
 
-		if USE_EXPERIMENTAL_PATTERNMATCHER:
-			# Add back the word, but only if we removed it in the first place.
-			if answer != '':
-				pm.replace(input_word, answer)
-
 		return results
 
-	def pronounce_sentence(self, input_sentence, multiprocess_words=False, pad=True):
+	# Sampled leave-one-out cross-validation of the pattern matcher pruned each way in settings, a list of
+	# (max_length, max_representations) pairs where None means no limit (see PatternMatcher.prune),
+	# next to the unpruned one. Pruned optimization dicts are built (and saved) as needed.
+	# Prints and returns, for each setting, the optimization dict's size, the pattern matching time per word,
+	# and each strategy's word accuracy over the same sample_size random words.
+	def pruning_report(self, settings, sample_size=500, seed=0, pad=True):
+		import random
+		import time
+		ldb = self.lexical_database_pad if pad else self.lexical_database
+		words = random.Random(seed).sample(list(ldb), min(sample_size, len(ldb)))
+		excludes = [(word, ldb[word]) for word in words]
+		report = []
+		for max_length, max_representations in [(None, None)] + list(settings):
+			if max_length is None and max_representations is None:
+				pm = self.pm_pad if pad else self.pm
+			else:
+				pm = PatternMatcher(ldb, self.output_folder, self.pattern_matcher_names[pad], pad, self.skip_every, self.offset, backend=self.backend, \
+					lexicon_version=self.lexicon_version, max_length=max_length, max_representations=max_representations)
+				self.catch_up(pm)
+			d = pm.substring_to_alt_domain_count_dict
+			row = {'max_length': max_length, 'max_representations': max_representations, \
+				'substrings': len(d), 'representations': sum(len(d[key]) for key in d)}
+			time_before = time.perf_counter()
+			matches = pm.populate_optimized_many(words, excludes=excludes)
+			row['seconds_per_word'] = (time.perf_counter() - time_before)/len(words)
+			words_correct = {}
+			for k, word in enumerate(words):
+				results = PronouncerByAnalogy.pronounce(word, ldb, None, pm, matches=matches[k])
+				if not isinstance(results, dict):
+					continue
+				for strategy in results:
+					if results[strategy].pronunciation == ldb[word]:
+						words_correct[strategy] = words_correct.get(strategy, 0) + 1
+			row['accuracy'] = {strategy: words_correct[strategy]/len(words) for strategy in words_correct}
+			report.append(row)
+
+		baseline = report[0]
+		for row in report:
+			print('max_length={}, max_representations={}: {} substrings ({:.1f}%), {} representations ({:.1f}%), {:.2f} ms per word'.format( \
+				row['max_length'], row['max_representations'], row['substrings'], 100*row['substrings']/baseline['substrings'], \
+				row['representations'], 100*row['representations']/baseline['representations'], 1000*row['seconds_per_word']))
+			for strategy in baseline['accuracy']:
+				print('\t{}: {:.2f}% words correct ({:+.2f})'.format(strategy, 100*row['accuracy'].get(strategy, 0), \
+					100*(row['accuracy'].get(strategy, 0) - baseline['accuracy'][strategy])))
+		return report
+
+	# Sampled leave-one-out cross-validation of beam search at each width in beam_widths (see Lattice.find_beam_paths),
+	# next to exact search, over sample_size random words of at least min_length letters (or all of them if sample_size is None.)
+	# Prints and returns, for each width, the time per word to build the lattice, search and decide, each strategy's
+	# word accuracy, and how often each strategy's pronunciation agrees with exact search's (on words exact search used it for.)
+	def beam_report(self, beam_widths, sample_size=500, seed=0, pad=True, min_length=0, batch_size=256):
+		import random
+		import time
+		ldb = self.lexical_database_pad if pad else self.lexical_database
+		pm = self.pm_pad if pad else self.pm
+		# Padding doesn't count toward length.
+		words = [word for word in ldb if len(word) - 2*pad >= min_length]
+		if sample_size is not None:
+			words = random.Random(seed).sample(words, min(sample_size, len(words)))
+		widths = [None] + list(beam_widths)
+		report = [{'beam_width': width, 'seconds': 0, 'words_correct': {}, 'words_agreeing': {}, 'words_compared': {}} for width in widths]
+		for start in range(0, len(words), batch_size):
+			batch = words[start:start + batch_size]
+			matches = pm.populate_optimized_many(batch, excludes=[(word, ldb[word]) for word in batch])
+			for k, word in enumerate(batch):
+				exact = None
+				for row in report:
+					time_before = time.perf_counter()
+					results = PronouncerByAnalogy.pronounce(word, ldb, None, pm, matches=matches[k], beam_width=row['beam_width'])
+					row['seconds'] += time.perf_counter() - time_before
+					if not isinstance(results, dict):
+						continue
+					if row['beam_width'] is None:
+						exact = results
+					elif exact is not None and len(results) == 1:
+						# A narrow beam may find a single path, every strategy's choice.
+						results = {strategy: results['min_length'] for strategy in exact}
+					for strategy in results:
+						if results[strategy].pronunciation == ldb[word]:
+							row['words_correct'][strategy] = row['words_correct'].get(strategy, 0) + 1
+						if exact is not None and strategy in exact:
+							row['words_compared'][strategy] = row['words_compared'].get(strategy, 0) + 1
+							if results[strategy].pronunciation == exact[strategy].pronunciation:
+								row['words_agreeing'][strategy] = row['words_agreeing'].get(strategy, 0) + 1
+		for row in report:
+			row['seconds_per_word'] = row.pop('seconds')/len(words)
+			row['accuracy'] = {strategy: count/len(words) for strategy, count in row.pop('words_correct').items()}
+			words_agreeing = row.pop('words_agreeing')
+			row['agreement'] = {strategy: words_agreeing.get(strategy, 0)/count for strategy, count in row.pop('words_compared').items()}
+
+		baseline = report[0]
+		print('{} words of at least {} letters:'.format(len(words), min_length))
+		for row in report:
+			print('{}: {:.2f} ms per word ({:.1f}%)'.format('Exact search' if row['beam_width'] is None else 'beam_width={}'.format(row['beam_width']), \
+				1000*row['seconds_per_word'], 100*row['seconds_per_word']/baseline['seconds_per_word']))
+			for strategy in baseline['accuracy']:
+				print('\t{}: {:.2f}% words correct ({:+.2f}), {:.2f}% agree with exact search'.format(strategy, 100*row['accuracy'].get(strategy, 0), \
+					100*(row['accuracy'].get(strategy, 0) - baseline['accuracy'][strategy]), 100*row['agreement'].get(strategy, 0)))
+		return report
+
+	# time_limit optionally bounds how many seconds the whole sentence may take, and max_frontier how many partial paths
+	# each word's search may keep (see pronounce.) Words reached late get what's left, at worst their best path found first.
+	# beam_width optionally searches each word by beam search (see pronounce.)
+	def pronounce_sentence(self, input_sentence, multiprocess_words=False, pad=True, time_limit=None, max_frontier=None, beam_width=None):
 		import time
 		time_before = time.perf_counter()
 		processed_sentence = input_sentence.lower()
@@ -233,18 +545,28 @@ class PronouncerByAnalogy:
 			pm = self.pm_pad if pad else self.pm
 
 		ldb = self.lexical_database_pad if pad else self.lexical_database
-		sdb = self.substring_database_pad if pad else self.substring_database
+		# Only OldPatternMatcher needs the substring databases. Don't load them otherwise.
+		sdb = None
+		if pm is None:
+			sdb = self.substring_database_pad if pad else self.substring_database
 
 		if not multiprocess_words:
-			for word in input_words:
-				word = PronouncerByAnalogy.pad_if(word, pad)
-				results_list.append(PronouncerByAnalogy.pronounce(word, ldb, sdb, pm=pm))
+			input_words = [PronouncerByAnalogy.pad_if(word, pad) for word in input_words]
+			# Pattern match the whole sentence at once.
+			matches_list = pm.populate_optimized_many(input_words) if pm is not None else [None]*len(input_words)
+			for word, matches in zip(input_words, matches_list):
+				time_left = None if time_limit is None else max(0, time_before + time_limit - time.perf_counter())
+				results_list.append(PronouncerByAnalogy.pronounce(word, ldb, sdb, pm=pm, matches=matches, time_limit=time_left, max_frontier=max_frontier, \
+					beam_width=beam_width))
 		else:
+			import functools
 			import multiprocessing as mp
 			num_processes = mp.cpu_count()
 			pool = mp.Pool(processes=num_processes)
-			results_list = pool.starmap(PronouncerByAnalogy.pronounce, \
-				([word, self.lexical_database, self.substring_database, pm] \
+			# Words are pronounced side by side, so each gets the whole time limit.
+			results_list = pool.starmap(functools.partial(PronouncerByAnalogy.pronounce, time_limit=time_limit, max_frontier=max_frontier, \
+				beam_width=beam_width), \
+				([word, self.lexical_database, self.substring_database if pm is None else None, pm] \
 				for word in input_words))
 		# pronounce returns a dict of entries AND a float value.
 		for candidates_dict in results_list:
@@ -262,6 +584,38 @@ class PronouncerByAnalogy:
 		print(' '.join(output_sentence))
 		return
 
+	# Pronounces input_word one letter at a time, as a type-ahead front end would, pattern matching
+	# each letter incrementally (see typeahead.py.) Returns each prefix's results, shortest first.
+	def pronounce_as_typed(self, input_word, pad=True, verbose=False):
+		from typeahead import TypeAhead
+		pm = self.pm_pad if pad else self.pm
+		ldb = self.lexical_database_pad if pad else self.lexical_database
+		typed = TypeAhead(pm, use_padding=pad)
+		results_list = []
+		for letter in input_word:
+			typed.extend(letter)
+			results_list.append(PronouncerByAnalogy.pronounce(typed.word, ldb, None, pm, verbose=verbose, lattice=typed.lattice_to_search()))
+		return results_list
+
+	# pronounce_as_typed should come to the same results for every prefix, from the first letter on, as pronouncing
+	# that prefix from scratch, with and without padding. Reports every (word, pad) on which they disagree.
+	def test_pronounce_as_typed(self, words):
+		def describe(results):
+			return {strategy: results[strategy].pronunciation for strategy in results} if isinstance(results, dict) else results
+		failures = []
+		for word in words:
+			for pad in (True, False):
+				pm = self.pm_pad if pad else self.pm
+				ldb = self.lexical_database_pad if pad else self.lexical_database
+				typed = self.pronounce_as_typed(word, pad=pad)
+				for length in range(1, len(word) + 1):
+					if describe(typed[length - 1]) != describe(PronouncerByAnalogy.pronounce(word[:length], ldb, None, pm)):
+						print('WARNING. pronounce_as_typed and pronounce disagree on {} (pad={}.)'.format(word[:length], pad))
+						failures.append((word, pad))
+						break
+		print('Test complete. {} out of {} words disagreed.'.format(len(failures), 2*len(words)))
+		return failures
+
 	def test_pronounce(self, input_word, lexical_database, substring_database, verbose=False, attempt_bypass=False, pm=None):
 		results, duration, lattice = PronouncerByAnalogy.pronounce(input_word, lexical_database, substring_database, verbose=verbose, attempt_bypass=attempt_bypass, pm=pm, test_mode=True)
 		if verbose:
@@ -270,12 +624,21 @@ class PronouncerByAnalogy:
 		return results, duration, lattice
 
 	# Setting test_mode to True returns lattice for testing.
+	# exclude is an optional (word, representation) pair for pm to leave out (see PatternMatcher.exclude_word.)
+	# matches optionally skips pattern matching with pm's output computed ahead of time (see PatternMatcher.populate_optimized_many.)
+	# k optionally decides between only the k shortest paths with the largest arc count products (see Lattice.find_best_paths.)
+	# time_limit optionally bounds how many seconds pronouncing may take, and max_frontier how many partial paths the search
+	# may keep at once. If the search runs out of either, results are {'approximate': the best candidate found} (see Lattice.decide.)
+	# beam_width optionally decides between only the shortest paths a beam search that wide finds (see Lattice.find_beam_paths.)
+	# lattice optionally skips building and populating, searching a lattice populated ahead of time (see TypeAhead.lattice_to_search.)
 	@staticmethod
-	def pronounce(input_word, lexical_database, substring_database, pm, verbose=False, attempt_bypass=False, test_mode=False):
+	def pronounce(input_word, lexical_database, substring_database, pm, verbose=False, attempt_bypass=False, test_mode=False, exclude=None, matches=None, \
+		k=None, time_limit=None, max_frontier=None, beam_width=None, lattice=None):
+		import time
+		deadline = time.perf_counter() + time_limit if time_limit is not None else None
 		# Check if we're using pad.
 		uses_padding = list(lexical_database)[0].startswith('#')
 		input_word = PronouncerByAnalogy.pad_if(input_word, uses_padding)
-		import time
 
 		if attempt_bypass and input_word in lexical_database:
 			time_before = time.perf_counter()
@@ -287,10 +650,13 @@ class PronouncerByAnalogy:
 				results = (results, time_after - time_before, None)
 			return results
 
+		if lattice is not None:
+			return PronouncerByAnalogy.search_and_decide(lattice, verbose, test_mode, 0, deadline, k, max_frontier, beam_width)
+
 		if verbose:
 			print('Building pronunciation lattice for "{}"...'.format(input_word))
 		# Construct lattice.
-		pl = Lattice(input_word)
+		pl = CompactLattice(input_word) if USE_COMPACT_LATTICE and pm is not None else Lattice(input_word)
 
 		# Bigrams unrepresented in the dataset will cause gaps in lattice paths.
 		#pl.flag_unrepresented_bigrams(input_word, lexical_database)
@@ -300,11 +666,10 @@ class PronouncerByAnalogy:
 		time_before = time.perf_counter()
 		# New, optimized method with current PatternMatcher.
 		if pm is not None:
-			matches = pm.populate_optimized(input_word, verbose=False)
-			for match in matches:
-				key, alt_domain_representation, row_index, count = match
-				match_count += count
-				pl.add_forced(*match)
+			if matches is None:
+				matches = pm.populate_optimized(input_word, verbose=False, exclude=exclude)
+			match_count += sum(match[3] for match in matches)
+			pl.add_all_forced(matches)
 		# OldPatternMatcher with multiprocessing.
 		elif MULTIPROCESS_LEGACY:
 			pl, matches = OldPatternMatcher.manage_batch_populate(pl, \
@@ -323,9 +688,20 @@ class PronouncerByAnalogy:
 		time_after = time.perf_counter()
 		duration = time_after - time_before
 		print('Lattice populated in {} seconds'.format(duration))
+		if LATTICE_SNAPSHOTS is not None:
+			from replay import save_snapshot
+			save_snapshot(LATTICE_SNAPSHOTS, pl)
+		return PronouncerByAnalogy.search_and_decide(pl, verbose, test_mode, duration, deadline, k, max_frontier, beam_width)
 
-
-		candidates = pl.find_all_paths()
+	# The rest of pronounce, once lattice pl is populated (in duration seconds.)
+	@staticmethod
+	def search_and_decide(pl, verbose, test_mode, duration, deadline, k, max_frontier, beam_width):
+		if beam_width is not None:
+			candidates = pl.find_beam_paths(beam_width)
+		elif k is None:
+			candidates = pl.find_all_paths(deadline=deadline, max_frontier=max_frontier)
+		else:
+			candidates = pl.find_best_paths(k, deadline=deadline, max_frontier=max_frontier)
 		results = pl.decide(candidates)
 		# Print with no regard for ground truth.
 		if verbose:
@@ -380,24 +756,41 @@ if __name__ == "__main__":
 
 	# Run a test that guarantees optimized dict structure will remain the same throughout cross validation
 	#print('\nAscertain removing and adding back each word does not change the optimized dict:')
-	#pba.pm.simulate_leaveoneout(pba.lexical_database, check_every=10000)
+	#pba.pm.simulate_leaveoneout(pba.lexical_database)
+	# Run a test that guarantees populate_optimized matches populate_optimized_legacy across the lexicon.
+	#pba.pm_pad.test_populate_optimized(pba.lexical_database_pad)
+	# Run a test that guarantees Lattice.add_all_forced builds the same lattices as add_forced, leaving each word out.
+	#words = list(pba.lexical_database_pad)
+	#Lattice.test_add_all_forced(zip(words, pba.pm_pad.populate_optimized_many(words, excludes=[(word, pba.lexical_database_pad[word]) for word in words])))
+	# Measure what pruning the optimization dict costs in accuracy.
+	#pba.pruning_report([(8, None), (None, 16), (8, 16)], sample_size=500)
+	# Measure what beam search costs in accuracy (and saves in time) on long words, across the whole lexicon.
+	#pba.beam_report([1, 4, 16, 64], sample_size=None, min_length=12)
 	pba.pronounce_sentence('The QUICK qzqzxz FOX jumps OVER the LAZY dog.')
 	#import cProfile
 	#cProfile.runctx('g(x)', {'x': 'The QUICK brown FOX jumps OVER the LAZY dog.', 'g': pba.pronounce_sentence}, {})
 
 	pba.cross_validate_pronounce('authentication', verbose=True)
+	# Re-pronounce a word after every letter typed, pattern matching incrementally.
+	#pba.pronounce_as_typed('authentication', verbose=True)
+	# Run a test that guarantees pronouncing as typed, padded or not, matches pronouncing each prefix from scratch.
+	#pba.test_pronounce_as_typed(['authentication', 'testing', 'qzqzxz'])
 
 	print('\nCompare old pattern matching method to new, optimized method\n(Bypasses USE_EXPERIMENTAL_PATTERNMATCHER flag):\n')
 	pba.compare_experimental('placable', verbose=True)
 
 	print('\nPronounce a word with the new method.\n')
 	pba.pronounce('the', pba.lexical_database_pad, pba.substring_database_pad, pba.pm_pad, attempt_bypass=False, verbose=True)
+	# Or decide between only the 10 shortest paths with the largest arc count products.
+	#pba.pronounce('supercalifragilisticexpialidocious', pba.lexical_database_pad, None, pba.pm_pad, verbose=True, k=10)
+	# Or settle for the best path found within 50 milliseconds.
+	#pba.pronounce('supercalifragilisticexpialidocious', pba.lexical_database_pad, None, pba.pm_pad, verbose=True, time_limit=0.05)
 
 	print('\nPronounce a sentence with the new method:\n')
 	pba.pronounce_sentence('The QUICK brown FOX jumps OVER the LAZY dog.')
 
 	print('\nTesting a word that is clearly not in the dataset\n(Bypasses USE_EXPERIMENTAL_PATTERNMATCHER flag):')
-	print('Notice how pathfinding via breadth-first-search is the current performance bottleneck.')
+	print('Pathfinding only follows shortest paths (see Lattice.ShortestPaths), so the gaps are found and patched quickly.')
 	pba.pronounce('solsolsolsolsol', pba.lexical_database, pba.substring_database, pba.pm, verbose=True)
 
 	print('\nRemove the test word from the dataset before attempt:\n')
@@ -405,4 +798,6 @@ if __name__ == "__main__":
 	
 	#print('\nCross validate with the new method.\n')
 	#pba.cross_validate(pad=True)
+	# Or, much faster, 10-fold.
+	#pba.cross_validate_kfold(k=10, pad=True)
 
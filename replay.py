@@ -0,0 +1,63 @@
+# Replays captured lattices through find_all_paths and decide, without loading a lexicon or pattern matching,
+# so that search and ranking can be benchmarked and profiled on their own, on lattices from real traffic.
+#
+# pronounce appends every lattice it builds (before any search) to the file pba.LATTICE_SNAPSHOTS names, if set.
+# The file is a stream of pickled snapshots (see Lattice.snapshot), one appended per lattice.
+#
+# Usage: python replay.py <snapshot file> [compact] [profile]
+#	compact replays them as CompactLattices, and profile runs the replay under cProfile.
+import pickle
+import time
+from lattice import Lattice
+
+# Appends lattice pl's snapshot to the file at path.
+def save_snapshot(path, pl):
+	with open(path, 'ab') as f:
+		pickle.dump(pl.snapshot(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Yields every snapshot in the file at path, in the order they were saved.
+def load_snapshots(path):
+	with open(path, 'rb') as f:
+		while True:
+			try:
+				yield pickle.load(f)
+			except EOFError:
+				return
+
+# Rebuilds each snapshot as a lattice_class (Lattice or CompactLattice), then searches and decides it, timing both.
+# Prints totals and the slowest lattices. Returns a list of (letters, results, search seconds, decide seconds), one per snapshot.
+def replay(path, lattice_class=Lattice, verbose=False, slowest=5):
+	import contextlib
+	import io
+	replayed = []
+	for snapshot in load_snapshots(path):
+		pl = lattice_class.from_snapshot(snapshot)
+		# find_all_paths and decide print as they go. Silence them unless verbose.
+		with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+			time_before = time.perf_counter()
+			candidates = pl.find_all_paths()
+			time_searched = time.perf_counter()
+			results = pl.decide(candidates)
+			time_decided = time.perf_counter()
+		replayed.append((pl.letters, results, time_searched - time_before, time_decided - time_searched))
+	search_duration = sum(entry[2] for entry in replayed)
+	decide_duration = sum(entry[3] for entry in replayed)
+	print('Replayed {} lattices. Searching took {:.3f} seconds, deciding {:.3f} seconds.'.format(len(replayed), search_duration, decide_duration))
+	for letters, results, search, decide in sorted(replayed, key=lambda entry: -(entry[2] + entry[3]))[:slowest]:
+		print('\t{}: searched in {:.4f} seconds, decided in {:.4f} seconds'.format(letters, search, decide))
+	return replayed
+
+if __name__ == "__main__":
+	import sys
+	if len(sys.argv) < 2:
+		print('Usage: python replay.py <snapshot file> [compact] [profile]')
+		exit()
+	lattice_class = Lattice
+	if 'compact' in sys.argv[2:]:
+		from compactlattice import CompactLattice
+		lattice_class = CompactLattice
+	if 'profile' in sys.argv[2:]:
+		import cProfile
+		cProfile.runctx('replay(path, lattice_class)', globals(), {'path': sys.argv[1], 'lattice_class': lattice_class}, sort='tottime')
+	else:
+		replay(sys.argv[1], lattice_class)
@@ -0,0 +1,126 @@
+# A lazily loaded alternative to PatternMatcher's flat substring_to_alt_domain_count_dict.
+#
+# Pronouncing a handful of words from the command line only ever looks up substrings starting with
+# a handful of letters, but unpickling the flat dict means loading all of them first. ShardedIndex instead
+# splits the dict by each substring's first character ('#' for padded words' beginnings) into one pickle per
+# character, kept in a folder alongside a small manifest:
+#
+#	<name>/manifest      {'a': ('shard-97', 82311), 'b': ('shard-98', 51230), ...}   (file, substring count)
+#	<name>/shard-97      {'ab': {...}, 'abb': {...}, ...}
+#	<name>/shard-98      {'ba': {...}, ...}
+#
+# Only the manifest is read up front. Each shard is loaded the first time a substring starting with its
+# character is looked up, and stays cached from then on. Inner dicts are the shard's own, so they're live.
+#
+# ShardedIndex behaves like a dict (get, [], in, del, len, iteration, ==), so PatternMatcher's add, remove
+# and simulate_leaveoneout work on it as before. Changes stay in memory until save().
+from collections.abc import MutableMapping
+import os
+import pickle
+
+class ShardedIndex(MutableMapping):
+	# Writes any dict-like optimization dict (flat dict, SubstringTrie, CompactIndex...) to folder path,
+	# preserving the order of each inner dict.
+	@staticmethod
+	def write(path, d):
+		shards = {}
+		for key in d:
+			shards.setdefault(key[0], {})[key] = d[key]
+		index = ShardedIndex(path, create=True)
+		index.shards = shards
+		index.manifest = {ch: (ShardedIndex.shard_name(ch), len(shards[ch])) for ch in shards}
+		index.dirty = set(shards)
+		index.save()
+		return index
+
+	@staticmethod
+	def shard_name(ch):
+		# By code point, since not every character is safe in a file name.
+		return 'shard-{}'.format(ord(ch))
+
+	def __init__(self, path, create=False):
+		self.path = path
+		self.shards = {} # Character -> loaded shard.
+		self.dirty = set() # Characters whose shards have changed since the last save.
+		if create:
+			os.makedirs(path, exist_ok=True)
+			self.manifest = {}
+			return
+		with open(os.path.join(path, 'manifest'), 'rb') as f:
+			self.manifest = pickle.load(f)
+
+	# The shard of substrings starting with ch, loaded if need be. None if there isn't one (and create is False.)
+	def shard(self, ch, create=False):
+		shard = self.shards.get(ch, None)
+		if shard is not None:
+			return shard
+		if ch in self.manifest:
+			with open(os.path.join(self.path, self.manifest[ch][0]), 'rb') as f:
+				shard = pickle.load(f)
+		elif create:
+			shard = {}
+			self.manifest[ch] = (ShardedIndex.shard_name(ch), 0)
+		else:
+			return None
+		self.shards[ch] = shard
+		return shard
+
+	# Writes changed shards, then the manifest.
+	def save(self):
+		for ch in self.dirty:
+			shard = self.shards[ch]
+			with open(os.path.join(self.path, self.manifest[ch][0]), 'wb') as f:
+				pickle.dump(shard, f)
+			self.manifest[ch] = (self.manifest[ch][0], len(shard))
+		with open(os.path.join(self.path, 'manifest'), 'wb') as f:
+			pickle.dump(self.manifest, f)
+		self.dirty = set()
+
+	# Returns a dict of the form {(substring, index within input_word): inner dict}
+	# for every substring of input_word (of length 2 or more) present in the index.
+	def find_substrings(self, input_word):
+		found = {}
+		for i in range(len(input_word) - 1):
+			shard = self.shard(input_word[i])
+			if shard is None:
+				continue
+			for j in range(i + 2, len(input_word) + 1):
+				key = input_word[i:j]
+				entry = shard.get(key, None)
+				# Every longer substring starting at i is missing, too.
+				if entry is None:
+					break
+				found[(key, i)] = entry
+		return found
+
+	def __getitem__(self, key):
+		entry = self.get(key, None)
+		if entry is None:
+			raise KeyError(key)
+		return entry
+
+	# Overridden for speed. Mapping's default goes through __getitem__ and a KeyError.
+	def get(self, key, default=None):
+		shard = self.shard(key[0]) if len(key) else None
+		if shard is None:
+			return default
+		return shard.get(key, default)
+
+	def __setitem__(self, key, value):
+		self.shard(key[0], create=True)[key] = value
+		self.dirty.add(key[0])
+
+	def __delitem__(self, key):
+		shard = self.shard(key[0]) if len(key) else None
+		if shard is None:
+			raise KeyError(key)
+		del shard[key]
+		self.dirty.add(key[0])
+
+	def __iter__(self):
+		for ch in list(self.manifest):
+			yield from list(self.shard(ch))
+
+	def __len__(self):
+		# Loaded shards count themselves. The rest are as the manifest last saw them.
+		return sum(len(self.shards[ch]) if ch in self.shards else self.manifest[ch][1] for ch in self.manifest)
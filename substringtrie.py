@@ -0,0 +1,149 @@
+# A trie-backed alternative to PatternMatcher's flat substring_to_alt_domain_count_dict.
+#
+# The flat dict stores every substring of every word as its own string key:
+#	{ ..., 'sa': {...}, 'sau': {...}, 'sauc': {...}, 'sauce': {...}, ... }
+# whereas the trie stores each letter once per shared prefix:
+#	root -> s -> a -> u -> c -> e
+#	             |    |    |    |
+#	           {...}{...}{...}{...}
+# where every node two or more letters deep holds the same inner dict of alternate domain
+# representations mapped to their counts, i.e. root -> s -> a -> u holds {'sc-': 65, '-c-': 9, ...}
+#
+# SubstringTrie behaves like a dict (get, [], in, del, len, iteration, ==), so PatternMatcher's add,
+# remove and simulate_leaveoneout work on it as before. The difference is find_substrings, which walks
+# the input word one letter at a time from each starting index and gives up on that index as soon as
+# a prefix is missing: if "xq" was never seen, neither was "xqz", "xqzz", etc.
+#
+# Most substrings (about 85% of them) have exactly one representation, so those are stored as a
+# (representation, count) tuple instead of an inner dict. The inner dict handed back by get or []
+# is therefore NOT always live: after changing it, store it again with trie[substring] = entry.
+from collections.abc import MutableMapping
+
+class SubstringTrie(MutableMapping):
+	class Node:
+		__slots__ = ('letters', 'children', 'counts')
+		def __init__(self):
+			# Children are kept as a string of their letters and a parallel list of nodes, since most
+			# nodes have only one or two children and a dict per node would cost more than the trie saves.
+			# Both stay None until needed: most nodes are leaves, and single letters have no counts.
+			self.letters = None
+			self.children = None
+			self.counts = None
+		# The inner dict of alternate domain representations mapped to their counts, or None.
+		def get_counts(self):
+			if type(self.counts) is tuple:
+				return {self.counts[0]: self.counts[1]}
+			return self.counts
+		def set_counts(self, counts):
+			if len(counts) == 1:
+				self.counts = next(iter(counts.items()))
+			else:
+				self.counts = counts
+		def child(self, ch):
+			if self.letters is None:
+				return None
+			i = self.letters.find(ch)
+			return self.children[i] if i != -1 else None
+		# Pickle as a plain tuple. Much smaller (and faster) than the default for slotted classes.
+		def __getstate__(self):
+			return (self.letters, self.children, self.counts)
+		def __setstate__(self, state):
+			self.letters, self.children, self.counts = state
+
+	def __init__(self, d=None):
+		self.root = self.Node()
+		self.size = 0 # Number of substrings with counts.
+		if d is None:
+			return
+		# Convert from a flat dict, preserving the order of each inner dict.
+		for key in d:
+			self[key] = d[key]
+
+	# Returns the node at the end of path substring, or None if any letter along the way is missing.
+	# When create is True, missing nodes are added instead.
+	def walk(self, substring, create=False):
+		node = self.root
+		for ch in substring:
+			child = node.child(ch)
+			if child is None:
+				if not create:
+					return None
+				child = self.Node()
+				if node.letters is None:
+					node.letters = ''
+					node.children = []
+				node.letters += ch
+				node.children.append(child)
+			node = child
+		return node
+
+	# The trie's equivalent to PatternMatcher.generate_substrings_largest_first + dict lookups.
+	# Returns a dict of the form {(substring, index within input_word): inner dict}
+	# for every substring of input_word (of length 2 or more) present in the trie.
+	def find_substrings(self, input_word):
+		found = {}
+		for i in range(len(input_word) - 1):
+			node = self.root
+			for j in range(i, len(input_word)):
+				node = node.child(input_word[j])
+				# Every longer substring starting at i is missing, too.
+				if node is None:
+					break
+				if node.counts is not None:
+					found[(input_word[i:j + 1], i)] = node.get_counts()
+		return found
+
+	def __getitem__(self, key):
+		node = self.walk(key)
+		if node is None or node.counts is None:
+			raise KeyError(key)
+		return node.get_counts()
+
+	# Overridden for speed. Mapping's default goes through __getitem__ and a KeyError.
+	def get(self, key, default=None):
+		node = self.walk(key)
+		if node is None or node.counts is None:
+			return default
+		return node.get_counts()
+
+	def __setitem__(self, key, value):
+		node = self.walk(key, create=True)
+		if node.counts is None:
+			self.size += 1
+		node.set_counts(value)
+
+	def __delitem__(self, key):
+		# Remember the path so emptied nodes can be pruned on the way back up.
+		path = [self.root]
+		for ch in key:
+			child = path[-1].child(ch)
+			if child is None:
+				raise KeyError(key)
+			path.append(child)
+		if path[-1].counts is None:
+			raise KeyError(key)
+		path[-1].counts = None
+		self.size -= 1
+		# Prune nodes left with neither counts nor children.
+		for depth in range(len(key), 0, -1):
+			node = path[depth]
+			if node.counts is not None or node.letters:
+				break
+			parent = path[depth - 1]
+			i = parent.letters.find(key[depth - 1])
+			parent.letters = parent.letters[:i] + parent.letters[i + 1:]
+			del parent.children[i]
+
+	# Depth-first, yielding each substring with counts.
+	def __iter__(self):
+		stack = [('', self.root)]
+		while stack:
+			prefix, node = stack.pop()
+			if node.counts is not None:
+				yield prefix
+			if node.letters is not None:
+				for ch, child in zip(node.letters, node.children):
+					stack.append((prefix + ch, child))
+
+	def __len__(self):
+		return self.size
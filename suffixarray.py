@@ -0,0 +1,179 @@
+# An on-demand alternative to PatternMatcher's precomputed substring_to_alt_domain_count_dict.
+#
+# The optimization dict holds every substring of every word, which grows with the sum of each word's length squared.
+# SuffixArrayIndex instead keeps the lexicon itself, as two aligned strings, and a suffix array over it:
+#
+#	text:      sauce\nsauna\n...            every word, in lexicon order, each followed by a newline
+#	phonemes:  sc-s-\nsc-nx\n...            every word's alternate domain representation, letter for letter
+#	suffixes:  [6, 0, 7, 1, ...]            the start of every suffix, sorted by the suffix up to its word's end
+#
+# so its size is proportional to the lexicon's. Every occurrence of a substring starts one suffix in a contiguous
+# range of the suffix array, found by binary search, and the substring's inner dict is counted from the representations
+# at those positions when it's looked up. Counting them in text order sees each representation first where the
+# optimization dict's build would have, so inner dicts come out in the same order, and populate_optimized's
+# output is the same as with any other backend.
+#
+# SuffixArrayIndex behaves like a read-only dict (get, [], in, len, iteration), built from the lexicon
+# rather than from the optimization dict. Use populate_optimized's exclude to leave words out of it.
+from array import array
+from collections.abc import Mapping
+
+# Substrings with at least this many occurrences have their inner dicts cached once counted.
+CACHE_OCCURRENCES = 256
+
+class SuffixArrayIndex(Mapping):
+	# Indexes a lexical database of the form {'word': 'alternate domain representation'} (aligned letter for letter.)
+	# max_length and max_representations apply PatternMatcher's pruning (see PatternMatcher.prune) at lookup time.
+	def __init__(self, word_to_alt_domain_dict, max_length=None, max_representations=None):
+		import time
+		time_before = time.perf_counter()
+		self.max_length = max_length
+		self.max_representations = max_representations
+		self.text = ''.join('{}\n'.format(word) for word in word_to_alt_domain_dict)
+		self.phonemes = ''.join('{}\n'.format(word_to_alt_domain_dict[word]) for word in word_to_alt_domain_dict)
+		self.suffixes = SuffixArrayIndex.sort_suffixes(self.text)
+		self.cache = {}
+		duration = time.perf_counter() - time_before
+		print('Done. Indexed {} words ({} suffixes) in {:.2f} seconds.'.format(len(word_to_alt_domain_dict), len(self.suffixes), duration))
+
+	# Suffix array by prefix doubling: sort every letter's position by the rank of its first k letters, then
+	# by the rank of its first 2k letters (the ranks at i and i + k), and so on, in O(n log n) per round.
+	# Suffixes end at their word's newline, so it takes one round per doubling of the longest word's length.
+	@staticmethod
+	def sort_suffixes(text):
+		n = len(text)
+		# Where each position's word ends.
+		ends = array('i', [0])*n
+		end = n
+		for i in range(n - 1, -1, -1):
+			if text[i] == '\n':
+				end = i
+			ends[i] = end
+		positions = [i for i in range(n) if text[i] != '\n']
+		longest = max((ends[i] - i for i in positions), default=0)
+		# Rank 0 is reserved for "past the end of the word."
+		rank = array('i', [0])*n
+		for i in positions:
+			rank[i] = ord(text[i]) + 1
+		k = 1
+		while True:
+			scale = max(rank) + 1
+			def key(i):
+				return rank[i]*scale + (rank[i + k] if i + k < ends[i] else 0)
+			# Stable, so identical suffixes stay in text order.
+			positions.sort(key=key)
+			# Re-rank by the first 2k letters.
+			new_rank = array('i', [0])*n
+			distinct = 0
+			previous = None
+			for i in positions:
+				current = key(i)
+				if current != previous:
+					distinct += 1
+					previous = current
+				new_rank[i] = distinct
+			rank = new_rank
+			k *= 2
+			if distinct == len(positions) or k >= longest:
+				return array('i', positions)
+
+	# The suffix at the k-th position of the suffix array, cut to length letters (or fewer, at the end of the text.)
+	def prefix(self, k, length):
+		start = self.suffixes[k]
+		return self.text[start:start + length]
+
+	# The range [lo, hi) of the suffix array whose suffixes start with key, searching within [lo, hi).
+	# A newline sorts before any letter, so a suffix cut short by its word's end sorts before its extensions.
+	def search(self, key, lo=0, hi=None):
+		hi = len(self.suffixes) if hi is None else hi
+		length = len(key)
+		left, right = lo, hi
+		while left < right:
+			mid = (left + right)//2
+			if self.prefix(mid, length) < key:
+				left = mid + 1
+			else:
+				right = mid
+		lo = left
+		right = hi
+		while left < right:
+			mid = (left + right)//2
+			if self.prefix(mid, length) <= key:
+				left = mid + 1
+			else:
+				right = mid
+		return lo, left
+
+	# The inner dict of the substring of length length occurring at suffix array range [lo, hi).
+	def count(self, lo, hi, length):
+		entry = {}
+		for start in sorted(self.suffixes[lo:hi]):
+			representation = self.phonemes[start:start + length]
+			entry[representation] = entry.get(representation, 0) + 1
+		if self.max_representations is not None and len(entry) > self.max_representations:
+			kept = set(sorted(entry, key=lambda representation: -entry[representation])[:self.max_representations])
+			entry = {representation: entry[representation] for representation in entry if representation in kept}
+		return entry
+
+	def lookup(self, key, lo, hi):
+		entry = self.cache.get(key, None)
+		if entry is None:
+			entry = self.count(lo, hi, len(key))
+			if hi - lo >= CACHE_OCCURRENCES:
+				self.cache[key] = entry
+		return entry
+
+	# Returns a dict of the form {(substring, index within input_word): inner dict}
+	# for every substring of input_word (of length 2 or more) present in the index.
+	def find_substrings(self, input_word):
+		found = {}
+		longest = len(input_word) if self.max_length is None else self.max_length
+		for i in range(len(input_word) - 1):
+			# Each substring's range lies within the range of the one a letter shorter.
+			lo, hi = self.search(input_word[i])
+			for j in range(i + 2, min(i + longest, len(input_word)) + 1):
+				key = input_word[i:j]
+				lo, hi = self.search(key, lo, hi)
+				# Every longer substring starting at i is missing, too.
+				if lo == hi:
+					break
+				found[(key, i)] = self.lookup(key, lo, hi)
+		return found
+
+	def __getitem__(self, key):
+		entry = self.get(key, None)
+		if entry is None:
+			raise KeyError(key)
+		return entry
+
+	def get(self, key, default=None):
+		if len(key) < 2 or '\n' in key or (self.max_length is not None and len(key) > self.max_length):
+			return default
+		lo, hi = self.search(key)
+		if lo == hi:
+			return default
+		return self.lookup(key, lo, hi)
+
+	# Every distinct substring (of length 2 or more), in suffix array order. Substrings a suffix shares
+	# with the one before it were already yielded there.
+	def __iter__(self):
+		previous = ''
+		for start in self.suffixes:
+			suffix = self.text[start:self.text.find('\n', start)]
+			if self.max_length is not None:
+				suffix = suffix[:self.max_length]
+			shared = 0
+			while shared < min(len(previous), len(suffix)) and previous[shared] == suffix[shared]:
+				shared += 1
+			for length in range(max(shared + 1, 2), len(suffix) + 1):
+				yield suffix[:length]
+			previous = suffix
+
+	def __len__(self):
+		return sum(1 for _ in self)
+
+	# The cache is rebuilt as needed.
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['cache'] = {}
+		return state
@@ -0,0 +1,232 @@
+# Incremental pattern matching and lattice building, for pronouncing a word as it's typed.
+#
+# populate_optimized looks up every substring of its input word, which is quadratic in the word's length,
+# and a front end re-pronouncing the word on every keystroke would pay that again for each letter typed.
+# TypeAhead instead keeps the raw counts it has looked up so far. When a letter is typed, it only looks up
+# the substrings ending at that letter, from shortest to longest, stopping at the first one missing
+# (every longer one is missing, too.)
+#
+# Decremented counts only look one letter out on either side (see PatternMatcher.populate_optimized), so of
+# the spans already matched, only those ending just before the new letter change: they've gained right parents.
+# Those are decremented again, along with the new spans ending at the new letter, and everything else is reused.
+#
+# With padding, the closing '#' moves on every keystroke, so the substrings ending at it are looked up
+# (and the spans just before it decremented against them) on every keystroke, without being kept as raw counts.
+#
+# TypeAhead also keeps the word's lattice, built from every span's decremented counts as populate_optimized's
+# matches would build it, and on every keystroke (see sync) replaces only the arcs of the spans ending at the
+# two or three indices whose counts can change, then relinks START_NODE and END_NODE (which moves.)
+# Each node's arcs are kept in the order a lattice built from scratch would list them, so searching it comes to
+# the same decisions. Either way, a keystroke costs lookups, decrements and arcs in proportion to the word's length,
+# not its square.
+#
+# matches() is what populate_optimized would return for the word typed so far, in the same order.
+# Raw counts are kept as looked up, so start a new TypeAhead after changing the pattern matcher.
+from lattice import Lattice
+from patternmatcher import PatternMatcher
+
+class TypeAhead:
+	# use_padding defaults to the pattern matcher's.
+	def __init__(self, pm, use_padding=None):
+		self.pm = pm
+		self.use_padding = pm.use_padding if use_padding is None else use_padding
+		# The word typed so far.
+		self.word = ''
+		# The word as matched, minus the closing '#' if padding.
+		self.letters = '#' if self.use_padding else ''
+		# Span (i, j) -> raw counts of letters[i:j], for every span found so far.
+		self.raw = {}
+		# Span (i, j) -> decremented counts (see PatternMatcher.decrement_span) as if the word ended with letters.
+		self.decremented = {}
+		# Span end j -> {span start i: (substring, decremented counts, arcs)} for every span of input_word()
+		# with any decremented counts, as the lattice holds it. Arcs are in the order of the counts.
+		self.spans = {}
+		# The lattice of input_word(), kept up to date by sync.
+		self.lattice = Lattice(self.input_word())
+		self.sync(range(len(self.input_word()) + 1))
+
+	# The word typed so far, padded if need be, as populate_optimized would see it.
+	def input_word(self):
+		return '{}#'.format(self.letters) if self.use_padding else self.letters
+
+	# Raw counts of every substring of letters ending at index j, by span.
+	def find_substrings_ending_at(self, letters, j):
+		d = self.pm.substring_to_alt_domain_count_dict
+		found = {}
+		for i in range(j - 2, -1, -1):
+			entry = d.get(letters[i:j], None)
+			# Every longer substring ending at j is missing, too.
+			if entry is None:
+				break
+			found[(i, j)] = entry
+		return found
+
+	# Decrements span (i, j) against its parents. raw maps a span to its raw counts, or None if it's missing.
+	def decrement_span(self, raw, i, j):
+		return PatternMatcher.decrement_span(raw((i, j)), raw((i - 1, j)) if i > 0 else None, raw((i, j + 1)), \
+			raw((i - 1, j + 1)) if i > 0 else None, approximate=self.pm.pruned)
+
+	# Decrements every span found ending at index j again.
+	def decrement_ending_at(self, j):
+		for i in range(j - 2, -1, -1):
+			if (i, j) not in self.raw:
+				break
+			self.decremented[(i, j)] = self.decrement_span(self.raw.get, i, j)
+
+	# Decremented counts of the spans of input_word() whose counts differ from those kept, because of the closing '#':
+	# those ending at it, and those ending just before it.
+	def revise_for_padding(self):
+		input_word = self.input_word()
+		j = len(input_word)
+		end = self.find_substrings_ending_at(input_word, j)
+		def raw(span):
+			return end.get(span, self.raw.get(span, None))
+		revised = {}
+		for span in end:
+			revised[span] = self.decrement_span(raw, *span)
+		for i in range(j - 3, -1, -1):
+			if (i, j - 1) not in self.raw:
+				break
+			revised[(i, j - 1)] = self.decrement_span(raw, i, j - 1)
+		return revised
+
+	# Types letters, one at a time.
+	def extend(self, letters):
+		for letter in letters:
+			length = len(self.input_word())
+			self.word += letter
+			self.letters += letter
+			j = len(self.letters)
+			self.raw.update(self.find_substrings_ending_at(self.letters, j))
+			self.decrement_ending_at(j - 1)
+			self.decrement_ending_at(j)
+			self.sync_after(length)
+
+	# Deletes the last letter typed.
+	def backspace(self):
+		if len(self.word) == 0:
+			return
+		length = len(self.input_word())
+		j = len(self.letters)
+		for i in range(j - 1):
+			self.raw.pop((i, j), None)
+			self.decremented.pop((i, j), None)
+		self.word = self.word[:-1]
+		self.letters = self.letters[:-1]
+		# The spans now ending the word have lost their right parents.
+		self.decrement_ending_at(j - 1)
+		self.sync_after(length)
+
+	# Syncs the spans that can have changed since input_word() was length letters long: those ending at the letters
+	# on either side of the change (and with padding, the letter before those, which the closing '#' revised.)
+	def sync_after(self, length):
+		length_now = len(self.input_word())
+		self.sync(range(min(length, length_now) - (1 if self.use_padding else 0), max(length, length_now) + 1))
+
+	# Brings the lattice up to date with the decremented counts of every span ending at each index in ends,
+	# replacing the arcs of those whose counts changed (as add_forced would add them), then relinks START_NODE
+	# and END_NODE as add_forced would have linked them. Nodes left without arcs are removed.
+	def sync(self, ends):
+		pl = self.lattice
+		input_word = self.input_word()
+		revised = self.revise_for_padding() if self.use_padding else {}
+		# Nodes that lost arcs.
+		touched = set()
+		def remove(arc):
+			touched.add(arc.from_node)
+			touched.add(arc.to_node)
+			pl.remove_arc(arc)
+		if pl.END_NODE.index != len(input_word):
+			for arc in list(pl.END_NODE.from_arcs):
+				remove(arc)
+			del pl.nodes[hash(pl.END_NODE)]
+			pl.letters = input_word
+			pl.END_NODE = Lattice.Node('', '', len(input_word))
+			# Keep START_NODE and END_NODE first, as Lattice does.
+			pl.nodes = {hash(pl.START_NODE): pl.START_NODE, hash(pl.END_NODE): pl.END_NODE, **pl.nodes}
+		# Nodes that gained arcs.
+		reordered = set()
+		for j in ends:
+			current = {}
+			for i in range(j - 2, -1, -1):
+				decremented = revised.get((i, j), self.decremented.get((i, j), None))
+				if decremented is None:
+					break
+				if len(decremented) != 0:
+					current[i] = (input_word[i:j], decremented)
+			held = self.spans.pop(j, {})
+			for i in sorted(set(held) | set(current)):
+				if i in held and held[i][:2] == current.get(i, None):
+					current[i] = held[i]
+					continue
+				if i in held:
+					for arc in held[i][2]:
+						remove(arc)
+				if i in current:
+					key, decremented = current[i]
+					arcs = []
+					for representation, count in decremented:
+						a = pl.create_or_find_node(key[0], representation[0], i)
+						b = pl.create_or_find_node(key[-1], representation[-1], j - 1)
+						arcs.append(pl.create_or_iterate_arc(representation[1:-1], key[1:-1], a, b, forced_count=count))
+						reordered.add(a)
+					current[i] = (key, decremented, arcs)
+			if len(current) != 0:
+				self.spans[j] = current
+		# A node's arcs go to later indices first (longer spans are matched first), then in the order of their span's counts.
+		for node in reordered:
+			ranks = {}
+			for j in set(arc.to_node.index + 1 for arc in node.to_arcs):
+				for k, arc in enumerate(self.spans[j][node.index][2]):
+					ranks[id(arc)] = (-j, k)
+			node.to_arcs.sort(key=lambda arc: ranks[id(arc)])
+		# Spans starting at 0 link START_NODE to their first nodes, longest span first, and every span ending the word
+		# links its last nodes to END_NODE. Either arc lists a '' in from_words for every match using it.
+		uses = {}
+		for j in sorted(self.spans, reverse=True):
+			if 0 in self.spans[j]:
+				for arc in self.spans[j][0][2]:
+					uses[arc.from_node] = uses.get(arc.from_node, 0) + 1
+		self.relink(pl.START_NODE.to_arcs, uses, lambda node: (pl.START_NODE, node), remove)
+		uses = {}
+		for i, (key, decremented, arcs) in sorted(self.spans.get(len(input_word), {}).items()):
+			for arc in arcs:
+				uses[arc.to_node] = uses.get(arc.to_node, 0) + 1
+		self.relink(pl.END_NODE.from_arcs, uses, lambda node: (node, pl.END_NODE), remove)
+		for node in touched:
+			if len(node.to_arcs) == 0 and len(node.from_arcs) == 0 and node is not pl.START_NODE and node is not pl.END_NODE:
+				pl.nodes.pop(hash(node), None)
+
+	# Makes the arcs in linked (START_NODE's or END_NODE's) link exactly the nodes in uses, in its order.
+	# endpoints maps a node to an arc's (from node, to node.)
+	def relink(self, linked, uses, endpoints, remove):
+		pl = self.lattice
+		for arc in list(linked):
+			node = arc.to_node if arc.from_node is pl.START_NODE else arc.from_node
+			if node not in uses:
+				remove(arc)
+		ranks = {}
+		for rank, (node, count) in enumerate(uses.items()):
+			arc = pl.create_or_iterate_arc('', '', *endpoints(node))
+			arc.from_words = ['']*count
+			ranks[id(arc)] = rank
+		linked.sort(key=lambda arc: ranks[id(arc)])
+
+	# The lattice to search for the word typed so far. Patching gaps (see Lattice.patch_gaps) adds arcs,
+	# so a word whose lattice has gaps gets a lattice of its own, built from scratch.
+	def lattice_to_search(self):
+		if self.lattice.reaches_end():
+			return self.lattice
+		pl = Lattice(self.input_word())
+		pl.add_all_forced(self.matches())
+		return pl
+
+	# Returns a list of tuples of the form (substr, alternate_domain_representation, index, count), as populate_optimized would:
+	# by span, longest first, then from left to right.
+	def matches(self):
+		matches = []
+		for i, j in sorted(((i, j) for j in self.spans for i in self.spans[j]), key=lambda span: (span[0] - span[1], span[0])):
+			key, decremented, arcs = self.spans[j][i]
+			for representation, count in decremented:
+				matches.append((key, representation, i, count))
+		return matches